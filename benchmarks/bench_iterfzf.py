@@ -0,0 +1,362 @@
+"""Benchmarks for ``iterfzf``.  They drive a real ``fzf`` without any terminal
+by using its ``--filter`` mode, and measure:
+
+- throughput of feeding items into ``fzf``'s stdin (items/s and bytes/s),
+- latency from calling ``iterfzf()`` to the first write into ``fzf``,
+- cold-start latency, i.e., time to import ``iterfzf`` and to spawn ``fzf``
+  for the first time in a fresh interpreter,
+- peak RSS of the Python side, and
+- time to parse a large ``multi=True`` output (eagerly and lazily), and
+- time and peak memory to encode a NumPy/Arrow string array compared with
+  a list of the same strings (if NumPy/pyarrow are installed).
+
+Each case runs in a fresh subprocess so that its peak RSS is not affected by
+other cases.  Run it like::
+
+    python benchmarks/bench_iterfzf.py --items 1000000
+
+"""
+import argparse
+import io
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import iterfzf
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Items consist of hexadecimal digits only, so that this query matches none:
+NO_MATCH_QUERY = 'zqzq'
+SHORT_LENGTH = 8
+LONG_LENGTH = 200
+STARTUP_RUNS = 20
+# Run by a fresh interpreter for each run of the startup case:
+STARTUP_CODE = '''
+import json, sys, time
+started = time.perf_counter()
+import iterfzf
+imported = time.perf_counter()
+first_write = []
+write_chunk = iterfzf.write_chunk
+
+def timed_write_chunk(stdin, chunk):
+    if not first_write:
+        first_write.append(time.perf_counter())
+    return write_chunk(stdin, chunk)
+
+iterfzf.write_chunk = timed_write_chunk
+called = time.perf_counter()
+iterfzf.iterfzf(['item'], __extra__=['--filter=zqzq'], executable=sys.argv[1])
+json.dump({
+    'import_seconds': imported - started,
+    'first_write_latency': first_write[0] - called,
+}, sys.stdout)
+'''
+
+
+def make_items(count, length, byte):
+    items = (
+        format(i, '08x') * (length // 8) + format(i, '08x')[:length % 8]
+        for i in range(count)
+    )
+    if byte:
+        return [item.encode() for item in items]
+    return list(items)
+
+
+def slow(items, every=1000, delay=0.001):
+    for i, item in enumerate(items):
+        if i % every == 0:
+            time.sleep(delay)
+        yield item
+
+
+def peak_rss():
+    """Returns the peak RSS of this process in KiB, or ``None``."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def bench_feed(count, length, byte, generator, executable):
+    items = make_items(count, length, byte)
+    size = sum(len(item if byte else item.encode()) + 1 for item in items)
+    source = {
+        'list': lambda: items,
+        'fast': lambda: (item for item in items),
+        'slow': lambda: slow(items),
+    }[generator]()
+    first_write = []
+    write_chunk = iterfzf.write_chunk
+
+    def timed_write_chunk(stdin, chunk):
+        if not first_write:
+            first_write.append(time.perf_counter())
+        return write_chunk(stdin, chunk)
+
+    iterfzf.write_chunk = timed_write_chunk
+    rss_before = peak_rss()
+    started = time.perf_counter()
+    iterfzf.iterfzf(
+        source,
+        __extra__=['--filter=' + NO_MATCH_QUERY],
+        executable=executable,
+    )
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': elapsed,
+        'items_per_second': count / elapsed,
+        'bytes_per_second': size / elapsed,
+        'first_write_latency': first_write[0] - started,
+        'peak_rss_kib': peak_rss(),
+        'peak_rss_before_kib': rss_before,
+    }
+
+
+def bench_parse(count, length, byte, lazy, executable):
+    items = make_items(count, length, True)
+    output = b''.join(item + b'\n' for item in items)
+    started = time.perf_counter()
+    if lazy:
+        for _ in iterfzf.iter_lines(io.BytesIO(output)):
+            pass
+    else:
+        iterfzf.parse_output(
+            0,
+            output,
+            byte=byte,
+            encoding='utf-8',
+            multi=True,
+            print_query=False
+        )
+    parse_elapsed = time.perf_counter() - started
+    # The same amount of output through a real fzf process:
+    started = time.perf_counter()
+    # Note that sort=True makes fzf to print nothing until it reads all
+    # items, or its output would not be read while items are being written:
+    result = iterfzf.iterfzf(
+        items if byte else [item.decode() for item in items],
+        sort=True,
+        multi=True,
+        lazy=lazy,
+        __extra__=['--filter='],
+        executable=executable,
+    )
+    if lazy:
+        for _ in result:
+            pass
+    return {
+        'parse_seconds': parse_elapsed,
+        'end_to_end_seconds': time.perf_counter() - started,
+        'peak_rss_kib': peak_rss(),
+    }
+
+
+def bench_startup(count, executable):
+    runs = []
+    for _ in range(count):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_CODE, executable],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        runs.append(json.loads(output))
+    # Medians, as the first run may also compile the bytecode:
+    return {
+        key: sorted(run[key] for run in runs)[count // 2]
+        for key in ('import_seconds', 'first_write_latency')
+    }
+
+
+def bench_column(count, length, source, executable):
+    import numpy
+    items = make_items(count, length, False)
+    if source == 'arrow':
+        import pyarrow
+        column = pyarrow.array(items)
+    else:
+        column = numpy.array(items, dtype=source[-1])
+
+    def measure(encode):
+        started = time.perf_counter()
+        encode()
+        elapsed = time.perf_counter() - started
+        # Measured separately, as tracing slows down Python code far more
+        # than NumPy:
+        tracemalloc.start()
+        encode()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak
+
+    column_seconds, column_peak = measure(
+        lambda: iterfzf.encode_column(column, encoding='utf-8')[0]
+    )
+    # What iterfzf() does for a list, which maps chosen lines back to
+    # the elements in the same way:
+    list_seconds, list_peak = measure(
+        lambda: iterfzf.encode_batch(
+            list(iterfzf.iter_with_index(items, str, [])),
+            byte=False,
+            encoding='utf-8',
+        )
+    )
+    return {
+        'column_seconds': column_seconds,
+        'column_peak_kib': column_peak // 1024,
+        'list_seconds': list_seconds,
+        'list_peak_kib': list_peak // 1024,
+    }
+
+
+def cases(count):
+    yield {'kind': 'startup', 'count': STARTUP_RUNS}
+    for byte in (False, True):
+        for length in (SHORT_LENGTH, LONG_LENGTH):
+            for generator in ('list', 'fast', 'slow'):
+                yield {
+                    'kind': 'feed',
+                    'count': count,
+                    'length': length,
+                    'byte': byte,
+                    'generator': generator,
+                }
+    for byte in (False, True):
+        for lazy in (False, True):
+            yield {
+                'kind': 'parse',
+                'count': count,
+                'length': SHORT_LENGTH,
+                'byte': byte,
+                'lazy': lazy,
+            }
+    sources = []
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        sources.extend(['numpy-U', 'numpy-S'])
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            sources.append('arrow')
+    for source in sources:
+        yield {
+            'kind': 'column',
+            'count': count,
+            'length': SHORT_LENGTH,
+            'source': source,
+        }
+
+
+def run_case(case, executable):
+    kind = case.pop('kind')
+    if kind == 'startup':
+        return bench_startup(executable=executable, **case)
+    elif kind == 'feed':
+        return bench_feed(executable=executable, **case)
+    elif kind == 'column':
+        return bench_column(executable=executable, **case)
+    return bench_parse(executable=executable, **case)
+
+
+def format_result(case, result):
+    if case['kind'] == 'startup':
+        return (
+            'startup {0:>3} runs  import {1:>7.2f} ms  '
+            'first write {2:>7.2f} ms'
+        ).format(
+            case['count'],
+            result['import_seconds'] * 1000,
+            result['first_write_latency'] * 1000,
+        )
+    elif case['kind'] == 'column':
+        return (
+            'column {count:>8,} x {length:>3}B {source:7}  '
+            '{0[column_seconds]:>7.3f} s  peak {0[column_peak_kib]} KiB  '
+            '(list: {0[list_seconds]:>7.3f} s  peak {0[list_peak_kib]} KiB)'
+        ).format(result, **case)
+    label = '{kind:5} {count:>9,} x {length:>3}B {type:5} {mode:4}'.format(
+        type='bytes' if case['byte'] else 'str',
+        mode=case.get('generator') or ('lazy' if case['lazy'] else 'list'),
+        **case
+    )
+    if case['kind'] == 'feed':
+        return (
+            '{0}  {1[items_per_second]:>12,.0f} items/s  '
+            '{2:>8.1f} MiB/s  first write {3:>7.2f} ms  '
+            'peak RSS {1[peak_rss_kib]} KiB'
+        ).format(
+            label,
+            result,
+            result['bytes_per_second'] / 1024 / 1024,
+            result['first_write_latency'] * 1000,
+        )
+    return (
+        '{0}  parse {1:>8.1f} ms  end-to-end {2:>8.1f} ms  '
+        'peak RSS {3[peak_rss_kib]} KiB'
+    ).format(
+        label,
+        result['parse_seconds'] * 1000,
+        result['end_to_end_seconds'] * 1000,
+        result,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '-n',
+        '--items',
+        type=int,
+        default=200000,
+        help='the number of items for each case (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-e',
+        '--executable',
+        help='the fzf executable to use (default: the bundled one, or '
+        'the one in the PATH)'
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='print the results as JSON lines'
+    )
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.executable = args.executable or iterfzf.find_executable()
+    if args.case:
+        json.dump(run_case(json.loads(args.case), args.executable), sys.stdout)
+        return
+    for case in cases(args.items):
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                '--case',
+                json.dumps(case),
+                '--executable',
+                args.executable,
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        result = json.loads(output)
+        if args.json:
+            print(json.dumps(dict(case, **result)))
+        else:
+            print(format_result(case, result))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@ intended to be used directly, but through a PEP 517-compliant frontend, e.g.,
 pip.
 
 """
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
 import json
 import os
 import os.path
@@ -12,7 +15,7 @@ import re
 import shutil
 import sys
 import tarfile
-from tempfile import NamedTemporaryFile
+import threading
 import time
 from urllib.request import Request, urlopen
 from urllib.error import HTTPError
@@ -43,23 +46,44 @@ asset_filename_re = re.compile(
     r'(?P<goos>[^-_]+)_(?P<goarch>[^.]+)'
     r'.(?P<ext>tgz|tar\.gz|tar\.bz2|zip)$'
 )
+fzf_checksums_filename = 'fzf_{0}_checksums.txt'.format(__fzf_version__)
 fzf_bin_path = Path(__file__).parent / 'iterfzf' / 'fzf'
 fzf_windows_bin_path = fzf_bin_path.parent / 'fzf.exe'
+# Downloaded binaries are cached in a content-addressed directory, i.e.,
+# <cache_dir>/<version>/<goos>_<goarch>/<sha256 of archive>/fzf[.exe]:
+cache_dir = Path(
+    os.environ.get('ITERFZF_CACHE_DIR')
+    or Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') /
+    'iterfzf'
+)
+# Kept out of the package directory, as flit ships everything in it:
+fzf_release_etag_path = cache_dir / __fzf_version__ / (
+    fzf_release_filename + '.etag'
+)
+# In the strict offline mode, everything is resolved from this directory
+# instead of the network (see also mirror_fzf_release()):
+offline_mirror = (
+    Path(os.environ['ITERFZF_OFFLINE_MIRROR'])
+    if os.environ.get('ITERFZF_OFFLINE_MIRROR') else None
+)
 wheel_filename_platform_tag_pattern = re.compile(
     r'(?<=-py3-none-)any(?=\.whl$)', re.IGNORECASE
 )
 
 
-def download_fzf_release_json(access_token=None, retry=3):
+def open_url(url, access_token=None, retry=3, headers=None):
+    """Opens the ``url``, sleeping out GitHub rate limits up to ``retry``
+    times.  In the offline mode, opens the corresponding file in the mirror
+    directory instead.
+    """
+    if offline_mirror is not None:
+        return open_mirrored(url)
+    headers = dict(headers or {})
     if access_token:
-        request = Request(
-            release_url,
-            headers={'Authorization': 'token ' + access_token},
-        )
-    else:
-        request = release_url
+        headers['Authorization'] = 'token ' + access_token
+    request = Request(url, headers=headers) if headers else url
     try:
-        r = urlopen(request)
+        return urlopen(request)
     except HTTPError as e:
         if e.code == 403 and e.info().get('X-RateLimit-Remaining') == '0':
             if retry:
@@ -68,7 +92,7 @@ def download_fzf_release_json(access_token=None, retry=3):
                     int(reset) -
                     time.time() if reset and reset.isdigit() else 5
                 )
-                return download_fzf_release_json(access_token, retry - 1)
+                return open_url(url, access_token, retry - 1, headers)
             raise RuntimeError(
                 'GitHub rate limit reached. To increase the limit configure '
                 'environment variable GITHUB_TOKEN.\n  ' + str(e)
@@ -76,11 +100,57 @@ def download_fzf_release_json(access_token=None, retry=3):
         elif e.code == 401 and access_token:
             raise RuntimeError('Invalid GitHub access token.')
         raise
+
+
+def mirrored_filename(url):
+    if url == release_url:
+        return fzf_release_filename
+    return url.split('?', 1)[0].rsplit('/', 1)[-1]
+
+
+def open_mirrored(url):
+    path = offline_mirror / mirrored_filename(url)
+    try:
+        return path.open('rb')
+    except IOError:
+        raise RuntimeError(
+            'Offline mode: {0} is missing from the mirror directory '
+            '(ITERFZF_OFFLINE_MIRROR).'.format(path)
+        )
+
+
+def download_fzf_release_json(access_token=None, retry=3):
+    """Downloads the release JSON, and saves it with its ETag next to
+    the package.  If it is already saved, it is revalidated with the ETag
+    rather than downloaded again, which does not count against GitHub's rate
+    limit either.
+    """
+    headers = {}
+    try:
+        etag = fzf_release_etag_path.read_text(encoding='utf-8').strip()
+    except IOError:
+        pass
+    else:
+        if etag and fzf_release_path.is_file():
+            headers['If-None-Match'] = etag
+    try:
+        r = open_url(release_url, access_token, retry, headers)
+    except HTTPError as e:
+        if e.code != 304:
+            raise
+        with fzf_release_path.open(encoding='utf-8') as f:
+            return json.load(f)
+    etag = getattr(r, 'headers', {}).get('ETag')
     d = r.read().decode("utf-8")
     r.close()
     try:
         with fzf_release_path.open('w', encoding='utf-8') as f:
             f.write(d)
+        if etag:
+            fzf_release_etag_path.parent.mkdir(parents=True, exist_ok=True)
+            fzf_release_etag_path.write_text(etag, encoding='utf-8')
+        elif fzf_release_etag_path.is_file():
+            fzf_release_etag_path.unlink()
     except IOError:
         pass
     return json.loads(d)
@@ -97,6 +167,8 @@ def get_fzf_release(access_token=None):
 def get_fzf_binary_url(goos, goarch, access_token=None):
     release = get_fzf_release(access_token=access_token)
     for asset in release['assets']:
+        if asset['name'] == fzf_checksums_filename:
+            continue
         m = asset_filename_re.match(asset['name'])
         if not m:
             warnings.warn('unmatched filename: ' + repr(asset['name']))
@@ -108,30 +180,190 @@ def get_fzf_binary_url(goos, goarch, access_token=None):
             return asset['browser_download_url'], m.group('ext')
 
 
-def extract(stream, ext, extract_to: Path):
-    with NamedTemporaryFile() as tmp:
-        shutil.copyfileobj(stream, tmp)
-        tmp.flush()
-        tmp.seek(0)
-        if ext == 'zip':
-            z = ZipFile(tmp, 'r')
+_checksums = {}
+_checksums_lock = threading.Lock()
+
+
+def get_fzf_checksums(access_token=None):
+    """Gets the map from asset names to their SHA-256 checksums.  They are
+    taken from the ``digest`` fields of the release assets, or from
+    the checksums file attached to the release if the fields are missing.
+    """
+    with _checksums_lock:
+        if _checksums:
+            return _checksums
+        release = get_fzf_release(access_token=access_token)
+        checksums_url = None
+        for asset in release['assets']:
+            digest = asset.get('digest') or ''
+            if digest.startswith('sha256:'):
+                _checksums[asset['name']] = digest[7:].lower()
+            elif asset['name'] == fzf_checksums_filename:
+                checksums_url = asset['browser_download_url']
+        if checksums_url:
+            r = open_url(checksums_url)
             try:
-                info = z.infolist()[0]
-                with extract_to.open('wb') as f:
-                    f.write(z.read(info))
+                for line in r.read().decode('utf-8').splitlines():
+                    checksum, _, name = line.strip().partition(' ')
+                    _checksums.setdefault(name.strip().lstrip('*'), checksum)
             finally:
-                z.close()
-        elif ext == 'tgz' or ext.startswith('tar.'):
-            tar = tarfile.open(fileobj=tmp)
-            try:
-                member, = [m for m in tar.getmembers() if m.isfile()]
+                r.close()
+        return _checksums
+
+
+class HashingReader:
+    """Wraps a binary ``stream`` to compute the SHA-256 checksum of what is
+    read from it.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.hash.update(chunk)
+        return chunk
+
+    def drain(self):
+        """Reads the rest of the stream, and returns the hex digest."""
+        while self.read(64 * 1024):
+            pass
+        return self.hash.hexdigest()
+
+
+def extract(stream, ext, extract_to: Path):
+    """Extracts the only file in the archive read from the ``stream``.
+    Tarballs are extracted while they are being read.
+    """
+    if ext == 'zip':
+        # ZIP files have to be seeked, but fzf's are just a few megabytes:
+        z = ZipFile(io.BytesIO(stream.read()), 'r')
+        try:
+            info = z.infolist()[0]
+            with extract_to.open('wb') as f:
+                f.write(z.read(info))
+        finally:
+            z.close()
+    elif ext == 'tgz' or ext.startswith('tar.'):
+        tar = tarfile.open(fileobj=stream, mode='r|*')
+        try:
+            extracted = False
+            for member in tar:
+                if not member.isfile():
+                    continue
+                elif extracted:
+                    raise ValueError('more than one file in the archive')
                 rf = tar.extractfile(member)
                 with extract_to.open('wb') as wf:
                     shutil.copyfileobj(rf, wf)
-            finally:
-                tar.close()
-        else:
-            raise ValueError('unsupported file format: ' + repr(ext))
+                extracted = True
+            if not extracted:
+                raise ValueError('no file in the archive')
+        finally:
+            tar.close()
+    else:
+        raise ValueError('unsupported file format: ' + repr(ext))
+
+
+def fetch_fzf_binary(goos, goarch, access_token=None, retry=3):
+    """Downloads the fzf binary for the ``goos`` and ``goarch`` into
+    the cache directory unless it is already cached, and returns its path.
+    The archive is verified against its SHA-256 checksum.
+    """
+    url, ext = get_fzf_binary_url(goos, goarch, access_token)
+    checksum = get_fzf_checksums(access_token).get(url.rsplit('/', 1)[-1])
+    name = 'fzf.exe' if goos == 'windows' else 'fzf'
+    platform_dir = cache_dir / __fzf_version__ / '{0}_{1}'.format(goos, goarch)
+    if checksum:
+        cached = platform_dir / checksum / name
+        if cached.is_file():
+            return cached
+    else:
+        warnings.warn('no checksum to verify: ' + repr(url))
+    platform_dir.mkdir(parents=True, exist_ok=True)
+    tmp = platform_dir / '.{0}.{1}.{2}.tmp'.format(
+        name, os.getpid(), threading.get_ident()
+    )
+    download_url = url
+    if access_token:
+        download_url = '{0}?access_token={1}'.format(url, access_token)
+    # The token is not sent as a header, since downloads are redirected to
+    # another host which refuses it:
+    r = open_url(download_url, retry=retry)
+    try:
+        reader = HashingReader(r)
+        extract(reader, ext, tmp)
+        digest = reader.drain()
+    except BaseException:
+        if tmp.is_file():
+            tmp.unlink()
+        raise
+    finally:
+        r.close()
+    if checksum and digest != checksum.lower():
+        tmp.unlink()
+        raise RuntimeError(
+            'checksum mismatch: {0!r} (expected {1}, got {2})'.format(
+                url, checksum, digest
+            )
+        )
+    cached = platform_dir / digest / name
+    cached.parent.mkdir(exist_ok=True)
+    tmp.chmod(tmp.stat().st_mode | 0o111)
+    os.replace(tmp, cached)
+    return cached
+
+
+def fetch_fzf_binaries(platforms=None, access_token=None, max_workers=None):
+    """Fetches the fzf binaries for the ``platforms`` (pairs of GOOS and
+    GOARCH; all platforms in :data:`goos_goarch_platform_tag_map` by
+    default) into the cache directory in parallel.  Returns a map from
+    the platforms to the paths of their binaries.
+    """
+    platforms = list(platforms or goos_goarch_platform_tag_map)
+    # Fetched once beforehand rather than by every thread:
+    get_fzf_checksums(access_token)
+    with ThreadPoolExecutor(max_workers or len(platforms)) as executor:
+        futures = {
+            (goos, goarch):
+                executor.submit(fetch_fzf_binary, goos, goarch, access_token)
+            for goos, goarch in platforms
+        }
+    return {key: future.result() for key, future in futures.items()}
+
+
+def mirror_fzf_release(directory, access_token=None, max_workers=None):
+    """Downloads the release JSON, the checksums file, and the archives of
+    all platforms into the ``directory`` in parallel, so that it can be
+    used as the mirror directory of the offline mode.  Archives are verified
+    against their checksums.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    release = get_fzf_release(access_token=access_token)
+    with (directory / fzf_release_filename).open('w', encoding='utf-8') as f:
+        json.dump(release, f)
+    checksums = get_fzf_checksums(access_token)
+    urls = [asset['browser_download_url'] for asset in release['assets']]
+
+    def download(url):
+        path = directory / mirrored_filename(url)
+        r = open_url(url)
+        try:
+            reader = HashingReader(r)
+            with path.open('wb') as f:
+                shutil.copyfileobj(reader, f)
+        finally:
+            r.close()
+        checksum = checksums.get(path.name)
+        if checksum and reader.hash.hexdigest() != checksum.lower():
+            path.unlink()
+            raise RuntimeError('checksum mismatch: ' + repr(url))
+        return path
+
+    with ThreadPoolExecutor(max_workers or len(urls) or 1) as executor:
+        return list(executor.map(download, urls))
 
 
 def download_fzf_binary(
@@ -147,36 +379,8 @@ def download_fzf_binary(
         fzf_windows_bin_path.unlink()
     bin_path = fzf_windows_bin_path if goos == 'windows' else fzf_bin_path
     if not bin_path.is_file():
-        asset = get_fzf_binary_url(goos, goarch, access_token)
-        url, ext = asset
-        if access_token:
-            url = '{0}?access_token={1}'.format(url, access_token)
-        try:
-            r = urlopen(url)
-        except HTTPError as e:
-            if e.code == 403 and e.info().get('X-RateLimit-Remaining') == '0':
-                if retry:
-                    reset = e.info().get('X-RateLimit-Reset')
-                    time.sleep(
-                        int(reset) -
-                        time.time() if reset and reset.isdigit() else 5
-                    )
-                    return download_fzf_binary(
-                        goos,
-                        goarch,
-                        overwrite=overwrite,
-                        access_token=access_token,
-                        retry=retry - 1,
-                    )
-                raise RuntimeError(
-                    'GitHub rate limit reached. To increate the limit use '
-                    '-g/--github-access-token option.\n  ' + str(e)
-                )
-            elif e.code == 401 and access_token:
-                raise RuntimeError('Invalid GitHub access token.')
-            raise
-        extract(r, ext, bin_path)
-        r.close()
+        cached = fetch_fzf_binary(goos, goarch, access_token, retry)
+        shutil.copyfile(cached, bin_path)
     mode = bin_path.stat().st_mode
     if not (mode & 0o111):
         bin_path.chmod(mode | 0o111)
@@ -331,3 +535,15 @@ if callable(getattr(buildapi, "prepare_metadata_for_build_editable", None)):
         buildapi.prepare_metadata_for_build_editable
     )
     __all__.append("prepare_metadata_for_build_editable")
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # Makes a mirror directory for the offline mode:
+        for path in mirror_fzf_release(sys.argv[1], github_token):
+            print(path)
+    else:
+        # Prefetches the fzf binaries for all platforms into the cache
+        # directory, e.g., before building wheels for every platform:
+        binaries = fetch_fzf_binaries(access_token=github_token)
+        for (goos, goarch), path in sorted(binaries.items()):
+            print('{0}_{1}: {2}'.format(goos, goarch, path))
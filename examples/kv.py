@@ -1,20 +1,20 @@
-"""Currently ``fzf`` and ``iterfzf()`` takes only some kind of strings,
-so you can't pass arbitrary Python objects into that.  Also there is no way
-to give each item some "hidden keys" besides displayed values.
+"""Since ``fzf`` takes only some kind of strings, ``iterfzf()`` takes
+a ``display`` function to show arbitrary Python objects.  Chosen items are
+returned as the original objects rather than their string representations.
 
 Therefore, if you want to show items in a dictionary, and make users to choose
-some items, then get chosen item keys, you need to give ``iterfzf()`` string
-representations of key-value pairs.  Here's an example:
+some items, then get chosen item keys, you can give ``iterfzf()`` the keys
+and a function to display each value.  For records with several fields,
+``iterfzf_table()`` shows them in aligned columns instead.  Here's an
+example:
 
 """
-from iterfzf import iterfzf
+from iterfzf import iterfzf, iterfzf_table
 
 
 def fzf_dict(d, multi):
-    r"""This assumes keys must have no tabs, hence ``'\t'`` as a separator."""
-    options = ('{0}\t{1}'.format(k, v) for k, v in d.items())
-    for kv in iterfzf(options, multi=multi):
-        yield kv[:kv.index('\t')]
+    """This shows values, but returns keys."""
+    return iterfzf(d.keys(), display=d.__getitem__, multi=multi)
 
 
 def main():
@@ -26,8 +26,30 @@ def main():
     }
     print(iterfzf(d.values()))
     keys = fzf_dict(d, multi=True)
-    for key in keys:
+    for key in keys or ():
         print(repr(key), '=>', repr(d[key]))
+    hosts = [
+        {
+            'host': 'web-1',
+            'region': 'us-east',
+            'status': 'up',
+            'owner': 'ann'
+        },
+        {
+            'host': 'db-primary',
+            'region': 'eu-west',
+            'status': 'up',
+            'owner': 'bo'
+        },
+        {
+            'host': 'cache',
+            'region': 'ap-south',
+            'status': 'down',
+            'owner': 'cy'
+        },
+    ]
+    host = iterfzf_table(hosts, match=['host', 'owner'])
+    print(host)
 
 
 if __name__ == '__main__':
@@ -1,13 +1,35 @@
-from __future__ import print_function
+from __future__ import annotations, print_function
 
-import errno
-from os import fspath, PathLike
-from pathlib import Path
-import subprocess
+import abc
+import functools
+import io
+import mmap
+import os
+from os import fspath, lseek, PathLike, SEEK_SET
 import sys
-from typing import AnyStr, Iterable, Literal, Mapping, Optional, Union
+import threading
+import time
+from time import monotonic
+import types
+from typing import (
+    Any, AnyStr, AsyncIterable, Callable, Generator, Hashable, Iterable,
+    Iterator, List, Literal, Mapping, MutableSet, NamedTuple, Optional,
+    Sequence, Tuple, TYPE_CHECKING, Union
+)
 
-__all__ = '__fzf_version__', '__version__', 'BUNDLED_EXECUTABLE', 'iterfzf'
+# These take a while to import, so that they are imported where they are
+# used instead; annotations are not evaluated at runtime (PEP 563):
+if TYPE_CHECKING:
+    import array
+    from pathlib import Path
+    import queue
+    import subprocess
+
+__all__ = (
+    '__fzf_version__', '__version__', 'BUNDLED_EXECUTABLE', 'BloomFilter',
+    'CandidateCache', 'CandidateSet', 'FzfSession', 'FzfStats', 'aiterfzf',
+    'fan_in', 'find_executable', 'fzf_version', 'iterfzf', 'iterfzf_table'
+)
 
 __fzf_version__ = '0.62.0'
 __version__ = '1.9.' + __fzf_version__
@@ -18,9 +40,132 @@ EXECUTABLE_NAME: Literal['fzf', 'fzf.exe'] = \
     WINDOWS_EXECUTABLE_NAME \
     if sys.platform == 'win32' \
     else POSIX_EXECUTABLE_NAME
-BUNDLED_EXECUTABLE: Optional[Path] = \
-    Path(__file__).parent / EXECUTABLE_NAME
 INTERRUPT_EXIT_CODE: int = 130
+DEFAULT_BATCH_SIZE: int = 64 * 1024
+DEFAULT_BATCH_LATENCY: float = 0.02
+DEFAULT_QUEUE_SIZE: int = 1024
+# The number of chunks iter_in_thread() splits its queue into:
+THREAD_CHUNKS: int = 8
+NEWLINE_POLICIES: Sequence[str] = ('raise', 'replace', 'skip', 'escape')
+# Hides the index prefixed to each line by iter_with_index(), and makes fzf
+# to match only the rest:
+INDEX_OPTIONS: Sequence[str] = ('--delimiter=\t', '--with-nth=2..')
+# In the filter mode, fzf prints lines transformed by --with-nth unless they
+# are sorted, so the index is only excluded from matching instead:
+FILTER_INDEX_OPTIONS: Sequence[str] = ('--delimiter=\t', '--nth=2..')
+# Inputs which are passed to fzf as they are, rather than being iterated:
+RAW_INPUT_TYPES = (
+    PathLike, int, io.RawIOBase, io.BufferedIOBase, bytes, bytearray,
+    memoryview, mmap.mmap
+)
+# Arrow types of which arrays are accepted by encode_column():
+ARROW_STRING_TYPES: Sequence[str] = (
+    'string', 'utf8', 'large_string', 'large_utf8', 'binary', 'large_binary'
+)
+
+
+def __getattr__(name: str) -> Any:
+    # BUNDLED_EXECUTABLE: Optional[Path] is made on demand (PEP 562), as
+    # pathlib takes a while to import and most programs never need it:
+    if name == 'BUNDLED_EXECUTABLE':
+        from pathlib import Path
+        return Path(__file__).parent / EXECUTABLE_NAME
+    raise AttributeError(
+        'module {0!r} has no attribute {1!r}'.format(__name__, name)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def find_executable(executable: Optional[PathLike] = None) -> str:
+    """Returns the path of the ``fzf`` executable to run.  The ``executable``
+    is used as it is if given.  Otherwise, the one bundled with iterfzf is
+    used if it exists and is executable, or the one found in the ``PATH``.
+    Raises :exc:`FileNotFoundError` if there is neither of them.
+    The result is cached, so that the file system is looked up only once.
+    """
+    if executable is not None:
+        return fspath(executable)
+    bundled = os.path.join(os.path.dirname(__file__), EXECUTABLE_NAME)
+    if os.path.isfile(bundled) and os.access(bundled, os.X_OK):
+        return bundled
+    import shutil
+    found = shutil.which(EXECUTABLE_NAME)
+    if found is None:
+        raise FileNotFoundError(
+            'fzf is neither bundled with iterfzf ({0}) nor found in '
+            'the PATH'.format(bundled)
+        )
+    return found
+
+
+@functools.lru_cache(maxsize=None)
+def fzf_version(
+    executable: Optional[PathLike] = None
+) -> Optional[Tuple[int, ...]]:
+    """Returns the version of the ``fzf`` ``executable`` (see
+    :func:`find_executable()`) as a tuple of integers, e.g., ``(0, 62, 0)``,
+    or ``None`` if it cannot be determined.  The bundled executable is not
+    run since its version is already known, and the others are run with
+    ``--version`` only once since the result is cached.
+    """
+    import re
+    import subprocess
+    try:
+        path = find_executable(executable)
+    except FileNotFoundError:
+        return None
+    if os.path.abspath(path) == os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), EXECUTABLE_NAME
+    ):
+        output = __fzf_version__
+    else:
+        try:
+            output = subprocess.run(
+                [path, '--version'],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=5,
+            ).stdout.decode('ascii', 'replace')
+        except (OSError, subprocess.SubprocessError):
+            return None
+    match = re.match(r'\s*(\d+)\.(\d+)(?:\.(\d+))?', output)
+    if match is None:
+        return None
+    return tuple(int(g) for g in match.groups() if g is not None)
+
+
+class FzfStats(NamedTuple):
+    """Statistics of an :func:`iterfzf()` call, which are passed to its
+    ``on_stats`` callback.
+    """
+
+    #: The seconds taken to spawn ``fzf``.
+    spawn_seconds: float
+
+    #: The number of items written to ``fzf``.  Lines of a file or a buffer
+    #: passed as it is are not counted, so it is ``0`` for them.
+    items_fed: int
+
+    #: The number of bytes written to ``fzf``.  ``0`` if it is unknown, i.e.,
+    #: a pipe is connected directly to ``fzf``.
+    bytes_fed: int
+
+    #: The seconds blocked on writing to ``fzf``.
+    write_seconds: float
+
+    #: The seconds spent inside the iterable, i.e., producing items.
+    iterable_seconds: float
+
+    #: Whether feeding was cut off as ``fzf`` had exited (i.e., EPIPE).
+    broken_pipe: bool
+
+    #: The exit code of ``fzf``.  ``-1`` if it has never been spawned, and
+    #: ``None`` if it is unknown yet (i.e., ``lazy=True``).
+    exit_code: Optional[int]
+
+    #: The seconds from the call to the end, including the time a user took.
+    total_seconds: float
 
 
 def format_option(option: Mapping[str, str]) -> str:
@@ -29,35 +174,808 @@ def format_option(option: Mapping[str, str]) -> str:
     )
 
 
-def iterfzf(
+def encode_batch(
+    batch: List[AnyStr],
+    *,
+    byte: bool,
+    encoding: str,
+    read0: bool = False,
+    newline_policy: str = 'raise'
+) -> bytes:
+    """Validates and encodes the ``batch`` of elements into a chunk of bytes
+    to write to ``fzf``, where every element is terminated by LF (or NUL if
+    ``read0`` is ``True``).  The elements must be all byte strings if
+    ``byte`` is ``True``, or all Unicode strings otherwise.
+
+    Validation is done on the whole chunk at once; only if the chunk turns
+    out to contain delimiters more than expected, the elements are checked
+    one by one and treated according to the ``newline_policy`` (see also
+    :func:`sanitize_batch()`).  Returns an empty chunk if no element remains.
+    """
+    delimiter = '\0' if read0 else '\n'
+    if byte:
+        delimiter = delimiter.encode()
+    size = len(batch)
+    batch.append(delimiter[:0])  # So that the last element is terminated
+    try:
+        chunk = delimiter.join(batch)
+    except TypeError:
+        for element in batch:
+            if isinstance(element, bytes) is not byte:
+                raise ValueError(
+                    'element values must be all byte strings or all '
+                    'unicode strings, not mixed of them: ' + repr(element)
+                )
+        raise
+    finally:
+        batch.pop()
+    if chunk.count(delimiter) != size or \
+            not read0 and (b'\r' if byte else '\r') in chunk:
+        batch = sanitize_batch(
+            batch, byte=byte, read0=read0, newline_policy=newline_policy
+        )
+        if not batch:
+            return b''
+        batch.append(delimiter[:0])
+        chunk = delimiter.join(batch)
+    return chunk if byte else chunk.encode(encoding)
+
+
+def encode_batches(
     iterable: Iterable[AnyStr],
     *,
-    # Sorting:
+    encoding: str,
+    read0: bool = False,
+    newline_policy: str = 'raise',
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_latency: Optional[float] = None
+) -> Generator[Tuple[List[AnyStr], bytes], None, None]:
+    """Groups the elements of the ``iterable`` into batches of about
+    ``batch_size`` bytes, and yields each batch along with its chunk encoded
+    by :func:`encode_batch()`.  If ``batch_latency`` is given, a batch is
+    also yielded once that many seconds have passed since the previous one.
+    Whether the elements are byte strings is told by the first element.
+    """
+    byte = None
+    batch = []
+    batch_bytes = 0
+    flushed_at = monotonic()
+    for element in iterable:
+        if byte is None:
+            byte = isinstance(element, bytes)
+        batch.append(element)
+        batch_bytes += len(element) + 1
+        if batch_bytes >= batch_size or batch_latency is not None and \
+                monotonic() - flushed_at >= batch_latency:
+            yield batch, encode_batch(
+                batch,
+                byte=byte,
+                encoding=encoding,
+                read0=read0,
+                newline_policy=newline_policy,
+            )
+            batch = []
+            batch_bytes = 0
+            flushed_at = monotonic()
+    if batch:
+        yield batch, encode_batch(
+            batch,
+            byte=byte,
+            encoding=encoding,
+            read0=read0,
+            newline_policy=newline_policy,
+        )
+
+
+def sanitize_batch(
+    batch: List[AnyStr],
+    *,
+    byte: bool,
+    read0: bool = False,
+    newline_policy: str = 'raise'
+) -> List[AnyStr]:
+    """Treats the elements of the ``batch`` containing CR/LF (or NUL if
+    ``read0`` is ``True``) according to the ``newline_policy``:
+
+    ``'raise'``
+        Raises :exc:`ValueError`.
+    ``'replace'``
+        Replaces them with spaces.
+    ``'skip'``
+        Leaves out such elements.
+    ``'escape'``
+        Replaces them with backslash escapes, e.g., ``\\n``.
+    """
+    chars = '\0' if read0 else '\r\n'
+    if byte:
+        chars = chars.encode()
+    if newline_policy == 'raise':
+        for element in batch:
+            if read0 and chars in element:
+                raise ValueError(
+                    'element values must not contain NUL in read0 mode: ' +
+                    repr(element)
+                )
+            elif not read0 and (chars[:1] in element or chars[1:] in element):
+                raise ValueError(
+                    r"element values must not contain CR({1!r})/"
+                    r"LF({2!r}): {0!r}".format(element, chars[:1], chars[1:])
+                )
+        return batch
+    elif newline_policy == 'replace':
+        spaces = b' ' * len(chars) if byte else ' ' * len(chars)
+        table = (bytes if byte else str).maketrans(chars, spaces)
+        return [element.translate(table) for element in batch]
+    elif newline_policy == 'skip':
+        import re
+        pattern = re.compile(b'[%s]' % chars if byte else '[%s]' % chars)
+        return [element for element in batch if not pattern.search(element)]
+    elif newline_policy == 'escape':
+        import re
+        pattern = re.compile(b'[%s]' % chars if byte else '[%s]' % chars)
+        escapes = {c: repr(c)[1:-1] for c in '\0\r\n'}
+        if byte:
+            escapes = {c.encode(): e.encode() for c, e in escapes.items()}
+        return [
+            pattern.sub(lambda m: escapes[m.group()], element)
+            for element in batch
+        ]
+    check_newline_policy(newline_policy)
+    return batch
+
+
+def check_newline_policy(newline_policy: str) -> None:
+    if newline_policy not in NEWLINE_POLICIES:
+        raise ValueError(
+            'newline_policy must be one of {0}: {1!r}'.format(
+                ', '.join(map(repr, NEWLINE_POLICIES)), newline_policy
+            )
+        )
+
+
+def check_bounds(max_items: Optional[int], timeout: Optional[float]) -> None:
+    if max_items is not None and max_items < 1:
+        raise ValueError('max_items must be 1 or more: ' + repr(max_items))
+    if timeout is not None and timeout < 0:
+        raise ValueError('timeout must not be negative: ' + repr(timeout))
+
+
+def check_rate_limits(
+    tail: Optional[int], rate_limit: Optional[float],
+    byte_rate_limit: Optional[float]
+) -> None:
+    if tail is not None and tail < 1:
+        raise ValueError('tail must be 1 or more: ' + repr(tail))
+    if rate_limit is not None and rate_limit <= 0:
+        raise ValueError('rate_limit must be positive: ' + repr(rate_limit))
+    if byte_rate_limit is not None and byte_rate_limit <= 0:
+        raise ValueError(
+            'byte_rate_limit must be positive: ' + repr(byte_rate_limit)
+        )
+
+
+def rate_interval(
+    items: int, nbytes: int, rate_limit: Optional[float],
+    byte_rate_limit: Optional[float]
+) -> float:
+    """Returns how many seconds to wait after writing ``items`` (of
+    ``nbytes`` bytes in total) not to exceed the ``rate_limit`` (items per
+    second) and the ``byte_rate_limit`` (bytes per second).
+    """
+    interval = 0.0
+    if rate_limit is not None:
+        interval = items / rate_limit
+    if byte_rate_limit is not None:
+        interval = max(interval, nbytes / byte_rate_limit)
+    return interval
+
+
+def write_chunk(stdin, chunk: bytes) -> bool:
+    """Writes the ``chunk`` into ``stdin`` and flushes it.  Returns
+    ``False`` if the pipe is broken, i.e., ``fzf`` has already exited."""
+    try:
+        stdin.write(chunk)
+        stdin.flush()
+    except IOError as e:
+        import errno
+        if e.errno != errno.EPIPE and errno.EPIPE != 32:
+            raise
+        return False
+    return True
+
+
+def close_stdin(stdin) -> None:
+    """Closes the ``stdin`` of ``fzf``, unless the pipe is broken, i.e.,
+    ``fzf`` has already exited."""
+    try:
+        stdin.close()
+    except IOError as e:
+        import errno
+        if e.errno != errno.EPIPE and errno.EPIPE != 32:
+            raise
+
+
+async def write_chunk_async(stdin, chunk: bytes) -> bool:
+    """The asynchronous version of :func:`write_chunk()`, which waits for
+    ``fzf`` to drain the pipe.
+    """
+    try:
+        stdin.write(chunk)
+        await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        return False
+    return True
+
+
+class RawFeed(NamedTuple):
+    """An ``fzf`` process spawned by :func:`feed_raw_input()`, and how its
+    input was fed.
+    """
+
+    #: The spawned ``fzf`` process.
+    proc: subprocess.Popen
+
+    #: The number of bytes fed, or ``None`` if it is unknown, i.e., the input
+    #: is a pipe or a device connected directly to ``fzf``.
+    bytes_fed: Optional[int]
+
+    #: The seconds taken to spawn ``fzf``.
+    spawn_seconds: float
+
+    #: The seconds blocked on writing to ``fzf``.
+    write_seconds: float
+
+    #: Whether feeding was cut off as ``fzf`` had exited (i.e., EPIPE).
+    broken_pipe: bool
+
+
+def feed_raw_input(
+    cmd: List[str],
+    source: Union[PathLike, int, io.IOBase, bytes, bytearray, memoryview,
+                  mmap.mmap],
+    chunk_size: int = DEFAULT_BATCH_SIZE
+) -> RawFeed:
+    """Spawns ``fzf`` reading the already newline-delimited ``source``
+    without looking into its lines.  A path, a file descriptor, or a file
+    object backed by a file descriptor is directly connected to the standard
+    input of ``fzf``, so that Python does not touch its content at all.
+    Other file objects and buffers (e.g., :class:`mmap.mmap`) are written
+    into the pipe in slices of ``chunk_size`` bytes.
+    """
+    import stat
+    import subprocess
+
+    def connect(fd: int) -> RawFeed:
+        # Only the size of the rest of a regular file is known in advance:
+        st = os.fstat(fd)
+        size = st.st_size - lseek(fd, 0, os.SEEK_CUR) \
+            if stat.S_ISREG(st.st_mode) else None
+        started = monotonic()
+        proc = subprocess.Popen(cmd, stdin=fd, stdout=subprocess.PIPE)
+        return RawFeed(proc, size, monotonic() - started, 0.0, False)
+
+    if isinstance(source, PathLike):
+        with open(source, 'rb') as f:
+            return connect(f.fileno())
+    elif isinstance(source, int):
+        return connect(source)
+    elif isinstance(source, io.IOBase):
+        try:
+            fd = source.fileno()
+        except (OSError, io.UnsupportedOperation):
+            pass
+        else:
+            if source.seekable():
+                # A buffered reader may have read ahead of its position:
+                lseek(fd, source.tell(), SEEK_SET)
+            return connect(fd)
+    started = monotonic()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    spawn_seconds = monotonic() - started
+    if isinstance(source, io.IOBase):
+        chunks = iter(lambda: source.read(chunk_size), b'')
+    else:
+        view = memoryview(source).cast('B')
+        chunks = (
+            view[i:i + chunk_size] for i in range(0, len(view), chunk_size)
+        )
+    bytes_fed = 0
+    broken_pipe = False
+    started = monotonic()
+    for chunk in chunks:
+        if not write_chunk(proc.stdin, chunk):
+            broken_pipe = True
+            break
+        bytes_fed += len(chunk)
+    close_stdin(proc.stdin)
+    return RawFeed(
+        proc, bytes_fed, spawn_seconds,
+        monotonic() - started, broken_pipe
+    )
+
+
+def encode_column(
+    column: Any,
+    *,
+    encoding: str,
+    read0: bool = False,
+    newline_policy: str = 'raise'
+) -> Optional[Tuple[memoryview, int, bool]]:
+    """If the ``column`` is a one-dimensional NumPy array of ``U``/``S``
+    dtype or an Arrow string/binary array (e.g., :class:`pyarrow.Array`,
+    :class:`pyarrow.ChunkedArray`), builds the whole input of ``fzf`` with
+    vectorized operations, each line prefixed by its row index in the same
+    way as :func:`iter_with_index()`.  Returns the payload, the number of
+    rows, and whether the rows are byte strings.  Returns ``None`` for any
+    other object, or if NumPy is not importable.
+    """
+    package = (type(column).__module__ or '').split('.')[0]
+    if package == 'numpy':
+        kind = getattr(getattr(column, 'dtype', None), 'kind', None)
+        if kind not in ('U', 'S') or column.ndim != 1:
+            return None
+        arrow = False
+    elif package == 'pyarrow':
+        arrow_type = str(getattr(column, 'type', ''))
+        if arrow_type not in ARROW_STRING_TYPES:
+            return None
+        kind = 'S' if arrow_type.endswith('binary') else 'U'
+        arrow = True
+    else:
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    byte = kind == 'S'
+    rows = len(column)
+    # Every input is turned into the concatenated bytes of its rows and
+    # their lengths, so that no index array per byte is needed:
+    if arrow:
+        if not byte and encoding.replace('-', '').lower() != 'utf8':
+            # Arrow strings are always UTF-8:
+            strings = ['' if s is None else s for s in column.to_pylist()]
+            return encode_column(
+                numpy.array(strings, dtype=str),
+                encoding=encoding,
+                read0=read0,
+                newline_policy=newline_policy
+            )
+        if hasattr(column, 'combine_chunks'):
+            column = column.combine_chunks()
+        buffers = column.buffers()
+        offsets = numpy.frombuffer(
+            buffers[1],
+            dtype=numpy.int64 if str(column.type).startswith('large_')
+            else numpy.int32
+        )[column.offset:column.offset + rows + 1] if rows else \
+            numpy.zeros(1, numpy.int64)
+        lengths = numpy.diff(offsets).astype(numpy.int64)
+        # The data buffer is already contiguous, and used without copying:
+        if buffers[2] is None:
+            text = numpy.zeros(0, numpy.uint8)
+        else:
+            data = numpy.frombuffer(buffers[2], numpy.uint8)
+            text = data[int(offsets[0]):int(offsets[-1])]
+    else:
+        column = numpy.ascontiguousarray(column)
+        matrix = None
+        if kind == 'U':
+            codes = column.view(numpy.uint32)
+            codes = codes.reshape(rows, column.dtype.itemsize // 4)
+            if codes.size and codes.max() < 0x80 and \
+                    encoding.replace('-', '').lower() in ('utf8', 'ascii'):
+                # ASCII-only text needs no encoding but narrowing:
+                matrix = codes.astype(numpy.uint8)
+            else:
+                column = numpy.ascontiguousarray(
+                    numpy.char.encode(column, encoding)
+                )
+        if matrix is None:
+            matrix = column.view(numpy.uint8)
+            matrix = matrix.reshape(rows, column.dtype.itemsize)
+        # Fixed-width strings are padded with trailing NULs, which are
+        # dropped by a mask of a byte per cell (ASCII-only text has as many
+        # bytes as code points):
+        lengths = numpy.char.str_len(column).astype(numpy.int64)
+        text = matrix[numpy.arange(matrix.shape[1]) < lengths[:, None]]
+        del matrix
+    indices = numpy.arange(rows, dtype=numpy.int64)
+    bad = text == 0 if read0 else (text == 10) | (text == 13)
+    if bad.any():
+        # Rows having delimiters are looked up only for those bytes:
+        bad_rows = numpy.unique(
+            numpy.searchsorted(
+                numpy.cumsum(lengths), numpy.flatnonzero(bad), side='right'
+            )
+        )
+        if newline_policy == 'raise':
+            row = column[int(bad_rows[0])]
+            raise ValueError(
+                (
+                    'element values must not contain NUL in read0 mode: '
+                    if read0 else
+                    r"element values must not contain CR('\r')/LF('\n'): "
+                ) + repr(row.as_py() if arrow else row)
+            )
+        elif newline_policy == 'replace':
+            text = text.copy()
+            text[bad] = 0x20
+        elif newline_policy == 'skip':
+            keep = numpy.ones(rows, dtype=bool)
+            keep[bad_rows] = False
+            text = text[numpy.repeat(keep, lengths)]
+            indices = indices[keep]
+            lengths = lengths[keep]
+        else:
+            # Escapes change lengths, which is not worth vectorizing for
+            # such a rare case:
+            rows_list = column.to_pylist() if arrow else column.tolist()
+            lines = sanitize_batch(
+                [
+                    b'' if r is None else
+                    r.encode(encoding) if isinstance(r, str) else r
+                    for r in rows_list
+                ],
+                byte=True,
+                read0=read0,
+                newline_policy=newline_policy
+            )
+            delimiter = b'\0' if read0 else b'\n'
+            payload = b''.join(
+                b'%d\t%s%s' % (i, line, delimiter)
+                for i, line in enumerate(lines)
+            )
+            return memoryview(payload), rows, byte
+    del bad
+    delimiter = 0 if read0 else ord('\n')
+    digits = len(str(max(rows - 1, 0)))
+    # Every row is preceded by a block of the delimiter ending the previous
+    # row, its zero-padded index, and a tab.  The payload is built with
+    # a leading delimiter, which is cut off:
+    block = digits + 2
+    blocks = numpy.empty((rows, block), numpy.uint8)
+    blocks[:, 0] = delimiter
+    blocks[:, -1] = ord('\t')
+    for k in range(1, block - 1):
+        # The k-th digits of 0, 1, 2, ... repeat 0-9 in runs of a place:
+        place = 10**(digits - k)
+        blocks[:, k] = numpy.repeat(
+            numpy.tile(
+                numpy.arange(ord('0'), ord('9') + 1, dtype=numpy.uint8),
+                rows // (place * 10) + 1
+            ), place
+        )[:rows]
+    if len(indices) < rows:
+        blocks = blocks[indices]
+    # Blocks and rows take turns, which a mask of a byte per byte tells
+    # apart, so that each of them is copied at once:
+    turns = numpy.empty(len(lengths) * 2 + 1, numpy.int64)
+    turns[0:-1:2] = block
+    turns[1::2] = lengths
+    turns[-1] = 1
+    mask = numpy.repeat(numpy.arange(len(turns)) % 2 == 1, turns)
+    payload = numpy.empty(len(mask), numpy.uint8)
+    payload[mask] = text
+    numpy.logical_not(mask, out=mask)
+    payload[mask] = numpy.append(blocks.reshape(-1), numpy.uint8(delimiter))
+    return memoryview(payload)[1:], rows, byte
+
+
+def close_iterable(iterable: Iterable[Any]) -> None:
+    """Closes the ``iterable`` if it is a generator, so that it releases its
+    resources right away.  Other iterables which have a ``close()`` method
+    (e.g., files or database cursors) are left to their owners.
+    """
+    if isinstance(iterable, types.GeneratorType):
+        iterable.close()
+
+
+async def aclose_iterable(iterable: AsyncIterable[Any]) -> None:
+    """The asynchronous version of :func:`close_iterable()`."""
+    if isinstance(iterable, types.AsyncGeneratorType):
+        await iterable.aclose()
+
+
+def put_unless(q: queue.Queue, entry: Any, stop: threading.Event) -> bool:
+    """Puts the ``entry`` into the bounded queue ``q``, waiting for a free
+    slot unless the ``stop`` event is set.  Returns ``False`` if stopped.
+    """
+    import queue
+    while not stop.is_set():
+        try:
+            q.put(entry, timeout=0.1)
+        except queue.Full:
+            continue
+        return True
+    return False
+
+
+def iter_in_thread(
+    iterable: Iterable[AnyStr],
+    maxsize: int = DEFAULT_QUEUE_SIZE,
+    idle_timeout: Optional[float] = None
+) -> Generator[Optional[AnyStr], None, None]:
+    """Consumes the ``iterable`` in a background thread, and yields its
+    elements through a queue bounded to about ``maxsize`` elements.  If no
+    element arrives within ``idle_timeout`` seconds, yields ``None`` instead
+    so that the caller can do something else meanwhile.  An exception
+    raised by the ``iterable`` is re-raised in the caller's thread.  Closing
+    the returned generator stops the background thread.
+    """
+    import queue
+    # Elements are passed in lists rather than one by one, as every put and
+    # get of a queue costs a lock and may wake up the other thread:
+    chunk_size = max(1, maxsize // THREAD_CHUNKS)
+    q = queue.Queue(max(1, maxsize // chunk_size))
+    pending = []  # Elements not put into the queue yet
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            try:
+                for element in iterable:
+                    with lock:
+                        pending.append(element)
+                        # The consumer takes a partial chunk by itself once
+                        # it runs out of chunks, unless it is already waiting:
+                        if len(pending) < chunk_size and not q.empty():
+                            continue
+                        chunk = pending[:]
+                        del pending[:]
+                    if not put_unless(q, (chunk, None), stop):
+                        return
+                error = StopIteration()
+            except BaseException as e:
+                error = e
+            # Elements taken before the end are passed first:
+            with lock:
+                chunk = pending[:]
+                del pending[:]
+            if not chunk or put_unless(q, (chunk, None), stop):
+                put_unless(q, (None, error), stop)
+        finally:
+            if stop.is_set():
+                close_iterable(iterable)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                chunk, error = q.get_nowait()
+            except queue.Empty:
+                with lock:
+                    chunk = pending[:]
+                    del pending[:]
+                if chunk:
+                    yield from chunk
+                    continue
+                try:
+                    chunk, error = q.get(timeout=idle_timeout)
+                except queue.Empty:
+                    yield None
+                    continue
+            if error is None:
+                yield from chunk
+            elif isinstance(error, StopIteration):
+                return
+            else:
+                raise error
+    finally:
+        stop.set()
+
+
+def fan_in(
+    sources: Iterable[Union[Iterable[Any], AsyncIterable[Any]]],
+    *,
+    tag: bool = False,
+    on_error: Optional[Callable[[int, BaseException], Any]] = None,
+    max_workers: Optional[int] = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE
+) -> Generator[Any, None, None]:
+    """Consumes the ``sources`` (iterables and/or asynchronous iterables)
+    concurrently in up to ``max_workers`` daemon threads, and yields their
+    elements interleaved in the order they arrive, so that a slow source
+    does not hold back the others.  Pass it to :func:`iterfzf()` to show
+    items from many sources in a single picker.
+
+    If ``tag`` is ``True``, yields ``(index, element)`` pairs instead, where
+    ``index`` is the position of the source in the ``sources``.  Combined
+    with the ``display`` option of :func:`iterfzf()`, it tells which source
+    a chosen item came from:
+
+    .. code-block:: python
+
+       index, path = iterfzf(fan_in(roots, tag=True),
+                             display=operator.itemgetter(1))
+
+    If a source raises an error, it is re-raised in the caller and the other
+    sources are stopped.  If ``on_error`` is given, it is called with
+    the index of the source and the error instead, and only that source
+    ends while the others go on.
+
+    Each asynchronous iterable is run in an event loop of its own in
+    a worker thread, not in the caller's one.  Therefore, asynchronous
+    iterables bound to a running event loop (e.g., ones reading from its
+    connections or tasks) cannot be passed; use :func:`aiterfzf()` for
+    them instead.
+    """
+    import collections
+    import queue
+    sources = list(sources)
+    pending = collections.deque(enumerate(sources))
+    q = queue.Queue(queue_size)
+    stop = threading.Event()
+    done = object()
+
+    async def consume_async(index, source):
+        try:
+            async for element in source:
+                if not put_unless(q, (index, element, None), stop):
+                    break
+        finally:
+            if stop.is_set():
+                await aclose_iterable(source)
+
+    def consume(index, source):
+        try:
+            if hasattr(source, '__aiter__'):
+                import asyncio
+                asyncio.run(consume_async(index, source))
+            else:
+                for element in source:
+                    if not put_unless(q, (index, element, None), stop):
+                        break
+                if stop.is_set():
+                    close_iterable(source)
+        except BaseException as e:
+            put_unless(q, (index, None, e), stop)
+        finally:
+            put_unless(q, (index, None, done), stop)
+
+    def work():
+        # Daemon threads, unlike a thread pool's, do not keep the interpreter
+        # from exiting while a source is blocked:
+        while not stop.is_set():
+            try:
+                index, source = pending.popleft()
+            except IndexError:
+                return
+            consume(index, source)
+
+    for _ in range(min(max_workers or len(sources), len(sources))):
+        threading.Thread(target=work, name='iterfzf-fan-in', daemon=True) \
+            .start()
+    remaining = len(sources)
+    try:
+        while remaining:
+            index, element, error = q.get()
+            if error is None:
+                yield (index, element) if tag else element
+            elif error is done:
+                remaining -= 1
+            elif on_error is None:
+                raise error
+            else:
+                on_error(index, error)
+    finally:
+        stop.set()
+
+
+def iter_unique(
+    iterable: Iterable[Any],
+    seen: Union['BloomFilter', MutableSet[Any]],
+    key: Optional[Callable[[Any], Hashable]] = None
+) -> Generator[Any, None, None]:
+    """Yields the elements of the ``iterable`` whose keys (the elements
+    themselves unless ``key`` is given) are not in ``seen`` yet, adding
+    the keys to ``seen``.  If the generator is closed before the end,
+    the ``iterable`` is closed as well.
+    """
+    add = seen.add
+    size = len(seen)
+    try:
+        # Checks if the size has grown rather than looking up the key and
+        # then adding it, which would hash every key twice:
+        if key is None:
+            for element in iterable:
+                add(element)
+                if len(seen) != size:
+                    size += 1
+                    yield element
+        else:
+            for element in iterable:
+                add(key(element))
+                if len(seen) != size:
+                    size += 1
+                    yield element
+    except GeneratorExit:
+        close_iterable(iterable)
+        raise
+
+
+def iter_with_index(
+    iterable: Iterable[Any], display: Callable[[Any], AnyStr], table: List[Any]
+) -> Iterable[AnyStr]:
+    """Appends every element of the ``iterable`` to the ``table``, and yields
+    its ``display`` string prefixed by its index in the ``table`` and a tab.
+    If the generator is closed before the end, the ``iterable`` is closed
+    as well.
+    """
+    append = table.append
+    try:
+        for element in iterable:
+            line = display(element)
+            # Appended before being yielded, as a preview of the line can be
+            # requested as soon as it is fed:
+            append(element)
+            if isinstance(line, bytes):
+                yield b'%d\t%s' % (len(table) - 1, line)
+            else:
+                yield '{0}\t{1}'.format(len(table) - 1, line)
+    except GeneratorExit:
+        close_iterable(iterable)
+        raise
+
+
+async def aiter_with_index(
+    iterable: AsyncIterable[Any], display: Callable[[Any], AnyStr],
+    table: List[Any]
+) -> AsyncIterable[AnyStr]:
+    """The asynchronous version of :func:`iter_with_index()`."""
+    append = table.append
+    try:
+        async for element in iterable:
+            line = display(element)
+            append(element)
+            if isinstance(line, bytes):
+                yield b'%d\t%s' % (len(table) - 1, line)
+            else:
+                yield '{0}\t{1}'.format(len(table) - 1, line)
+    except GeneratorExit:
+        await aclose_iterable(iterable)
+        raise
+
+
+def index_options(cmd: Sequence[str]) -> Sequence[str]:
+    """Returns the options to hide the index prefixed to each line by
+    :func:`iter_with_index()`, which depend on whether the ``cmd`` turns on
+    the filter mode (``--filter``/``-f``).
+    """
+    for arg in cmd[1:]:
+        if arg.startswith(('--filter', '-f')):
+            return FILTER_INDEX_OPTIONS
+    return INDEX_OPTIONS
+
+
+def build_command(
+    *,
     sort: bool = False,
-    # Search mode:
     extended: bool = True,
     exact: bool = False,
     case_sensitive: Optional[bool] = None,
-    # Interface:
     multi: bool = False,
     mouse: bool = True,
     bind: Optional[Mapping[str, str]] = None,
     color: Optional[Mapping[str, str]] = None,
     print_query: bool = False,
-    # Layout:
     prompt: str = '> ',
     ansi: bool = False,
     header: str = '',
     preview: Optional[str] = None,
     tmux: Optional[Union[str, bool]] = False,
-    # Misc:
     query: str = '',
     cycle: bool = False,
     __extra__: Iterable[str] = (),
-    encoding: Optional[str] = None,
-    executable: PathLike = BUNDLED_EXECUTABLE or EXECUTABLE_NAME
-):
-    cmd = [fspath(executable), '--prompt=' + prompt]
+    executable: Optional[PathLike] = None,
+    read0: bool = False,
+    tail: Optional[int] = None
+) -> List[str]:
+    """Turns the options of :func:`iterfzf()` into an ``fzf`` command line.
+    """
+    cmd = [find_executable(executable), '--prompt=' + prompt]
     if not sort:
         cmd.append('--no-sort')
     if not extended:
@@ -88,53 +1006,91 @@ def iterfzf(
         cmd.append('--ansi')
     if cycle:
         cmd.append('--cycle')
+    if read0:
+        cmd.extend(['--read0', '--print0'])
+    if tail:
+        cmd.append('--tail={0}'.format(tail))
     if __extra__:
         cmd.extend(__extra__)
-    encoding = encoding or sys.getdefaultencoding()
-    proc = None
-    stdin = None
-    byte = None
-    lf = u'\n'
-    cr = u'\r'
-    for line in iterable:
-        if byte is None:
-            byte = isinstance(line, bytes)
-            if byte:
-                lf = b'\n'
-                cr = b'\r'
-        elif isinstance(line, bytes) is not byte:
-            raise ValueError(
-                'element values must be all byte strings or all '
-                'unicode strings, not mixed of them: ' + repr(line)
-            )
-        if lf in line or cr in line:
-            raise ValueError(
-                r"element values must not contain CR({1!r})/"
-                r"LF({2!r}): {0!r}".format(line, cr, lf)
-            )
-        if proc is None:
-            proc = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=None
-            )
-            stdin = proc.stdin
-        if not byte:
-            line = line.encode(encoding)
-        try:
-            stdin.write(line + b'\n')
-            stdin.flush()
-        except IOError as e:
-            if e.errno != errno.EPIPE and errno.EPIPE != 32:
-                raise
+    return cmd
+
+
+def iter_lines(
+    stream,
+    delimiter: bytes = b'\n',
+    block_size: int = DEFAULT_BATCH_SIZE
+) -> Generator[bytes, None, None]:
+    """Reads the ``stream`` in blocks of ``block_size`` bytes, and yields
+    the lines split by the ``delimiter`` in bulk.  Lines do not include
+    the ``delimiter``, and trailing CRs are stripped from LF-delimited lines.
+    """
+    read = getattr(stream, 'read1', stream.read)
+    rest = b''
+    while True:
+        block = read(block_size)
+        if not block:
             break
+        lines = (rest + block).split(delimiter)
+        rest = lines.pop()
+        if delimiter == b'\n':
+            for line in lines:
+                yield line.rstrip(b'\r')
+        else:
+            yield from lines
+    if rest:
+        yield rest.rstrip(b'\r') if delimiter == b'\n' else rest
+
+
+def iter_output(
+    proc: subprocess.Popen,
+    lines: Iterable[bytes],
+    *,
+    byte: bool,
+    encoding: str,
+    table: Optional[Sequence[Any]] = None,
+    on_exit: Optional[Callable[[], Any]] = None
+) -> Generator[Any, None, None]:
+    """Lazily decodes the output ``lines`` of the ``fzf`` ``proc`` as they
+    are consumed.  Once the ``lines`` are exhausted or the generator is
+    closed, the ``proc`` is reaped and ``on_exit`` is called if given.
+    See also :func:`parse_output()`.
+    """
     try:
-        stdin.close()
-    except IOError as e:
-        if e.errno != errno.EPIPE and errno.EPIPE != 32:
-            raise
-    exit_code = proc.wait() if proc else -1
+        for line in lines:
+            if table is not None:
+                yield table[int(line[:line.index(b'\t')])]
+            elif byte:
+                yield line
+            else:
+                yield line.decode(encoding)
+        if proc.wait() == INTERRUPT_EXIT_CODE:
+            raise KeyboardInterrupt()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        proc.stdout.close()
+        if on_exit is not None:
+            on_exit()
+
+
+def parse_output(
+    exit_code: int,
+    output: bytes,
+    *,
+    byte: bool,
+    encoding: str,
+    multi: bool,
+    print_query: bool,
+    read0: bool = False,
+    table: Optional[Sequence[Any]] = None
+):
+    """Turns the exit code and the output of ``fzf`` into the return value
+    of :func:`iterfzf()`.  The ``output`` is split in one pass on LFs,
+    or on NULs if ``read0`` is ``True``.  If the ``table`` is given, lines
+    are prefixed by indices into it (see also :func:`iter_with_index()`),
+    and the corresponding elements of the ``table`` are returned instead.
+    """
     if exit_code == INTERRUPT_EXIT_CODE:
         raise KeyboardInterrupt()
 
@@ -143,9 +1099,22 @@ def iterfzf(
             return None, None
         else:
             return None
-    stdout = proc.stdout
     decode = (lambda b: b) if byte else (lambda t: t.decode(encoding))
-    output = [decode(ln.strip(b'\r\n\0')) for ln in iter(stdout.readline, b'')]
+    output = output.split(b'\0' if read0 else b'\n')
+    if output and not output[-1]:
+        output.pop()  # The last line is terminated as well
+    if not read0:
+        output = [ln.strip(b'\r\0') for ln in output]
+    if table is None:
+        output = [decode(ln) for ln in output]
+    else:
+        # The query line, if any, is not prefixed by an index:
+        offset = 1 if print_query and output else 0
+        output[:offset] = [decode(ln) for ln in output[:offset]]
+        # int() takes bytes as well, so the rest of lines need no decoding:
+        output[offset:] = [
+            table[int(ln[:ln.index(b'\t')])] for ln in output[offset:]
+        ]
     if print_query:
         try:
             if multi:
@@ -162,3 +1131,1865 @@ def iterfzf(
                 return output[0]
             except IndexError:
                 return None
+
+
+class CandidateSet(Sequence[AnyStr]):
+    """An immutable set of candidates which are validated and encoded only
+    once into a contiguous buffer, so that it can be passed to
+    :func:`iterfzf()` many times, each of which is a single bulk write.
+    Chosen items are returned as the same type of the original elements.
+
+    .. code-block:: python
+
+       files = CandidateSet(walk_project_files())
+       while True:
+           path = iterfzf(files)
+
+    It is also a read-only sequence of the elements; offsets of elements in
+    the buffer are indexed at the first random access.  The options are
+    the same as :func:`iterfzf()`.
+    """
+
+    def __init__(
+        self,
+        iterable: Iterable[AnyStr],
+        *,
+        encoding: Optional[str] = None,
+        read0: bool = False,
+        newline_policy: Literal['raise', 'replace', 'skip',
+                                'escape'] = 'raise',
+        batch_size: int = DEFAULT_BATCH_SIZE
+    ):
+        check_newline_policy(newline_policy)
+        self.encoding = encoding or sys.getdefaultencoding()
+        self.read0 = read0
+        self.delimiter = b'\0' if read0 else b'\n'
+        byte = None
+        chunks = []
+        for batch, chunk in encode_batches(
+            iterable,
+            encoding=self.encoding,
+            read0=read0,
+            newline_policy=newline_policy,
+            batch_size=batch_size,
+        ):
+            if byte is None:
+                byte = isinstance(batch[0], bytes)
+            chunks.append(chunk)
+        #: The newline-delimited (or NUL-delimited if ``read0`` is ``True``)
+        #: buffer of the encoded candidates.
+        self.buffer: bytes = b''.join(chunks)
+        #: Whether the original elements are byte strings.
+        self.byte: bool = bool(byte)
+        self._offsets = None
+
+    @property
+    def offsets(self) -> 'array.array':
+        """The offsets of elements in the :attr:`buffer`, which has one more
+        item than elements: the end of the buffer.
+        """
+        if self._offsets is None:
+            import array
+            import itertools
+            lines = self.buffer.split(self.delimiter)
+            lines.pop()
+            self._offsets = array.array('Q', [0])
+            self._offsets.extend(
+                itertools.accumulate(len(line) + 1 for line in lines)
+            )
+        return self._offsets
+
+    @property
+    def nbytes(self) -> int:
+        """The approximate number of bytes this set occupies."""
+        offsets = 0 if self._offsets is None else \
+            self._offsets.itemsize * len(self._offsets)
+        return len(self.buffer) + offsets
+
+    def __len__(self) -> int:
+        return self.buffer.count(self.delimiter) if self._offsets is None \
+            else len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        offsets = self.offsets
+        if index < 0:
+            index += len(offsets) - 1
+        if not 0 <= index < len(offsets) - 1:
+            raise IndexError('candidate index out of range')
+        element = self.buffer[offsets[index]:offsets[index + 1] - 1]
+        return element if self.byte else element.decode(self.encoding)
+
+    def __iter__(self) -> Iterator[AnyStr]:
+        lines = self.buffer.split(self.delimiter)
+        lines.pop()
+        if self.byte:
+            return iter(lines)
+        return (line.decode(self.encoding) for line in lines)
+
+    def __repr__(self) -> str:
+        return '<{0}.{1} of {2} candidates ({3} bytes)>'.format(
+            type(self).__module__,
+            type(self).__qualname__, len(self), len(self.buffer)
+        )
+
+
+class CandidateCache:
+    """A least recently used cache of :class:`CandidateSet` objects, which
+    keeps them up to ``max_bytes`` in total.
+
+    .. code-block:: python
+
+       cache = CandidateCache(max_bytes=256 * 1024 * 1024)
+       files = cache.get(root, lambda: walk(root), version=mtime(root))
+       path = iterfzf(files)
+
+    A set is rebuilt if the ``version`` passed to :meth:`get()` differs from
+    the one it was built with, so that a changed source is not served from
+    the cache.  A set larger than ``max_bytes`` by itself is never cached.
+    It is thread-safe.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        import collections
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: Any,
+        factory: Callable[[], Iterable[AnyStr]],
+        *,
+        version: Any = None,
+        **options
+    ) -> CandidateSet:
+        """Gets the candidate set for the ``key``.  If it is not cached or
+        its ``version`` differs, builds a new set from the iterable returned
+        by the ``factory``, with the ``options`` for :class:`CandidateSet`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+        candidates = CandidateSet(factory(), **options)
+        candidates.offsets  # Indexes it beforehand to count its size
+        with self._lock:
+            self._discard(key)
+            if candidates.nbytes <= self.max_bytes:
+                self._entries[key] = version, candidates
+                self.nbytes += candidates.nbytes
+                while self.nbytes > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+        return candidates
+
+    def invalidate(self, key: Any = None) -> None:
+        """Discards the set of the ``key``, or all sets if it is omitted."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self.nbytes = 0
+            else:
+                self._discard(key)
+
+    def _discard(self, key: Any) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1].nbytes
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class BloomFilter:
+    """A set-like filter which tells whether a key has already been added,
+    in bounded memory regardless of the number of keys.  It may mistake
+    a new key for an added one at about the ``error_rate`` up to
+    ``capacity`` keys (and more often beyond that), but never the other way
+    around.  Pass it as the ``dedupe`` option of :func:`iterfzf()` to drop
+    duplicates from a huge stream approximately:
+
+    .. code-block:: python
+
+       iterfzf(read_log(), dedupe=BloomFilter(capacity=10_000_000))
+
+    Keys have to be hashable, and are hashed by :func:`hash()`.
+    """
+
+    def __init__(self, capacity: int = 1024 * 1024, error_rate: float = 0.01):
+        import math
+        if capacity < 1:
+            raise ValueError('capacity must be 1 or more: ' + repr(capacity))
+        elif not 0 < error_rate < 1:
+            raise ValueError(
+                'error_rate must be between 0 and 1: ' + repr(error_rate)
+            )
+        self.capacity = capacity
+        self.error_rate = error_rate
+        #: The number of bits.
+        self.size = max(
+            8, int(-capacity * math.log(error_rate) / math.log(2)**2)
+        )
+        #: The number of bit positions per key.
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: Hashable) -> List[int]:
+        # Double hashing: derives all positions from the halves of a hash,
+        # which is scrambled first since hash() of an int is the int itself:
+        h = hash(key) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key: Hashable) -> None:
+        bits = self.bits
+        new = False
+        for position in self._positions(key):
+            byte = bits[position >> 3]
+            mask = 1 << (position & 7)
+            if not byte & mask:
+                bits[position >> 3] = byte | mask
+                new = True
+        if new:
+            self.count += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __len__(self) -> int:
+        """The number of added keys, except for those mistaken for already
+        added ones.
+        """
+        return self.count
+
+    def __repr__(self) -> str:
+        return '{0}(capacity={1!r}, error_rate={2!r})'.format(
+            type(self).__qualname__, self.capacity, self.error_rate
+        )
+
+
+class CallbackServer(abc.ABC):
+    """A loopback HTTP server through which commands run by ``fzf`` (e.g.,
+    ``--preview`` or ``reload``) call back into the current process, so that
+    no Python interpreter has to be spawned for each of them.  Subclasses
+    implement :meth:`handle()`.
+    """
+
+    def __init__(self):
+        self.server = None
+        self.token = None
+
+    def start(self) -> None:
+        """Starts serving in a background thread."""
+        import http.server
+        import secrets
+        if self.server is not None:
+            raise RuntimeError('the server is already started')
+        self.token = token = secrets.token_hex(16)
+        handle = self.handle
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                if self.path != '/' + token:
+                    self.send_error(403)
+                    return
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                # The response is streamed until the connection is closed:
+                self.send_response(200)
+                self.end_headers()
+
+                def write(chunk: bytes) -> None:
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+
+                try:
+                    handle(body, write)
+                except OSError:
+                    pass  # fzf has killed the client, e.g., as it's stale
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), Handler
+        )
+        self.server.daemon_threads = True
+        threading.Thread(
+            target=self.server.serve_forever,
+            kwargs=dict(poll_interval=0.1),
+            daemon=True
+        ).start()
+
+    def command(self, placeholder: str, *, from_file: bool = False) -> str:
+        """Returns the client command for ``fzf``, which posts
+        the ``placeholder`` (e.g., ``{q}``) to the server and prints
+        the response.  If ``from_file`` is ``True``, the ``placeholder``
+        is a path to the content to post instead (e.g., ``{f}``).
+        """
+        import shutil
+        if self.server is None:
+            raise RuntimeError('the server is not started')
+        port = self.server.server_address[1]
+        url = 'http://127.0.0.1:{0}/{1}'.format(port, self.token)
+        curl = shutil.which('curl')
+        if curl:
+            return '{0} -sSN {1} {2}'.format(
+                quote_path(curl),
+                ('--data-binary @' if from_file else '--data-raw ') +
+                placeholder,
+                url,
+            )
+        # Falls back to Python, skipping site for a quicker startup:
+        client = (
+            "import os,sys,http.client as h;"
+            "c=h.HTTPConnection('127.0.0.1',{0});"
+            "c.request('POST','/{1}',{2});"
+            "r=c.getresponse();o=sys.stdout.buffer;"
+            "[o.write(b)and o.flush()for b in iter(lambda:r.read1(65536),b'')]"
+        ).format(
+            port,
+            self.token,
+            "open(sys.argv[1],'rb').read()"
+            if from_file else 'os.fsencode(sys.argv[1])',
+        )
+        return '{0} -S -c {1} {2}'.format(
+            quote_path(sys.executable), quote_path(client), placeholder
+        )
+
+    @abc.abstractmethod
+    def handle(self, body: bytes, write: Callable[[bytes], Any]) -> None:
+        """Handles the ``body`` posted by the client, and responds by
+        calling ``write`` with chunks of bytes.  Raises :exc:`OSError` if
+        the client has gone.
+        """
+
+    def close(self) -> None:
+        """Stops serving."""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class PreviewServer(CallbackServer):
+    """Serves previews rendered by a Python callable to ``fzf``, which runs
+    ``command('{f}', from_file=True)`` as its ``--preview`` command.
+    The ``resolve`` function turns the focused line (in bytes) into the item
+    passed to ``render``.
+
+    Rendered previews are kept in a least recently used cache of
+    ``cache_size`` entries.  Since previews are rendered one at a time,
+    a request superseded by a newer one (i.e., the cursor has already moved
+    on) while waiting for its turn is dropped without being rendered.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[Any], AnyStr],
+        resolve: Callable[[bytes], Any],
+        *,
+        encoding: str,
+        cache_size: int = 256
+    ):
+        import collections
+        super().__init__()
+        self.render = render
+        self.resolve = resolve
+        self.encoding = encoding
+        self.cache_size = cache_size
+        self.generation = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+
+    def handle(self, body: bytes, write: Callable[[bytes], Any]) -> None:
+        preview = self.serve(body)
+        if preview:
+            write(preview)
+
+    def serve(self, line: bytes) -> Optional[bytes]:
+        """Renders the preview of the ``line``, or returns ``None`` if
+        the request is superseded.
+        """
+        if line[-1:] in (b'\n', b'\0'):
+            line = line[:-1]
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+            preview = self._cache.get(line)
+            if preview is not None:
+                self._cache.move_to_end(line)
+                return preview
+        with self._render_lock:
+            if generation != self.generation:
+                return None
+            try:
+                preview = self.render(self.resolve(line))
+            except Exception:
+                import traceback
+                preview = traceback.format_exc()
+            if not isinstance(preview, bytes):
+                preview = str(preview).encode(self.encoding)
+            with self._lock:
+                self._cache[line] = preview
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return preview
+
+
+class TailTable:
+    """A table which keeps only the last ``size`` elements appended to it,
+    as ``fzf --tail`` does.  Its length is the number of elements ever
+    appended, so that the indices given by :func:`iter_with_index()` stay
+    valid while older elements are dropped.
+    """
+
+    def __init__(self, size: int):
+        import collections
+        self.elements = collections.deque(maxlen=size)
+        self.count = 0
+        # Elements are looked up by the preview server in another thread:
+        self._lock = threading.Lock()
+
+    def append(self, element: Any) -> None:
+        with self._lock:
+            self.elements.append(element)
+            self.count += 1
+
+    def __getitem__(self, index: int) -> Any:
+        with self._lock:
+            dropped = self.count - len(self.elements)
+            if not dropped <= index < self.count:
+                raise IndexError('no element at the index: ' + repr(index))
+            return self.elements[index - dropped]
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class GenerationTable:
+    """Looks up the :attr:`~SourceServer.table` of the latest generation of
+    the ``server``, or the ``initial`` table if the source has never been
+    reloaded.
+    """
+
+    def __init__(self, initial: Sequence[Any], server: 'SourceServer'):
+        self.initial = initial
+        self.server = server
+
+    def current(self) -> Sequence[Any]:
+        table = self.server.table
+        return self.initial if table is None else table
+
+    def __getitem__(self, index: int) -> Any:
+        return self.current()[index]
+
+    def __len__(self) -> int:
+        return len(self.current())
+
+
+class SourceServer(CallbackServer):
+    """Serves candidates generated from the current query by a Python
+    callable to ``fzf``, which runs ``command('{q}')`` on every change of
+    the query through ``reload``.  The ``wrap`` function (e.g.,
+    :func:`iter_with_index()`) is applied to the iterable returned by
+    the ``source`` along with a fresh :attr:`table` for each generation,
+    so that the indices of a generation are not mixed with those of
+    the previous ones.
+
+    Requests are debounced by :attr:`debounce` seconds, and a generation
+    is cancelled (i.e., its iterable is closed) as soon as the query
+    changes again, so that fast typing costs less rather than more.
+    Complete results are kept for each query in a least recently used cache
+    of up to :attr:`cache_size` queries and :attr:`max_cache_bytes` in total.
+    """
+
+    #: How long to wait for the query to settle down, in seconds.
+    debounce: float = 0.05
+
+    #: The number of queries whose results are cached.
+    cache_size: int = 64
+
+    #: The total size of cached results in bytes.
+    max_cache_bytes: int = 64 * 1024 * 1024
+
+    def __init__(
+        self,
+        source: Callable[[str], Iterable[Any]],
+        wrap: Optional[Callable[[Iterable[Any], List[Any]],
+                                Iterable[AnyStr]]] = None,
+        *,
+        new_table: Callable[[], List[Any]] = list,
+        encoding: str,
+        read0: bool = False,
+        newline_policy: str = 'raise',
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_latency: float = DEFAULT_BATCH_LATENCY
+    ):
+        import collections
+        super().__init__()
+        self.source = source
+        self.wrap = wrap or (lambda iterable, table: iter(iterable))
+        self.new_table = new_table
+        self.encoding = encoding
+        self.read0 = read0
+        self.newline_policy = newline_policy
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.generation = 0
+        #: The table filled by the ``wrap`` function for the latest
+        #: generation, or ``None`` if the source has never been reloaded.
+        self.table = None
+        self.cache_bytes = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def handle(self, body: bytes, write: Callable[[bytes], Any]) -> None:
+        query = body.decode(self.encoding, 'replace')
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+            cached = self._cache.get(query)
+            if cached is not None:
+                self._cache.move_to_end(query)
+                chunks, self.table = cached
+        if cached is not None:
+            for chunk in chunks:
+                write(chunk)
+            return
+        time.sleep(self.debounce)
+        if generation != self.generation:
+            return
+        chunks = []
+        nbytes = 0
+        table = self.new_table()
+        with self._lock:
+            if generation != self.generation:
+                return
+            self.table = table
+        iterable = self.source(query)
+        try:
+            for _, chunk in encode_batches(
+                self.wrap(iterable, table),
+                encoding=self.encoding,
+                read0=self.read0,
+                newline_policy=self.newline_policy,
+                batch_size=self.batch_size,
+                batch_latency=self.batch_latency,
+            ):
+                if generation != self.generation:
+                    return
+                write(chunk)
+                chunks.append(chunk)
+                nbytes += len(chunk)
+        finally:
+            close_iterable(iterable)
+        if nbytes > self.max_cache_bytes:
+            return
+        with self._lock:
+            evicted = self._cache.pop(query, None)
+            if evicted is not None:
+                self.cache_bytes -= sum(map(len, evicted[0]))
+            self._cache[query] = chunks, table
+            self.cache_bytes += nbytes
+            while len(self._cache) > self.cache_size or \
+                    self.cache_bytes > self.max_cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self.cache_bytes -= sum(map(len, evicted[0]))
+
+
+def iterfzf(
+    iterable: Optional[Iterable[AnyStr]],
+    *,
+    # Sorting:
+    sort: bool = False,
+    # Search mode:
+    extended: bool = True,
+    exact: bool = False,
+    case_sensitive: Optional[bool] = None,
+    # Interface:
+    multi: bool = False,
+    mouse: bool = True,
+    bind: Optional[Mapping[str, str]] = None,
+    color: Optional[Mapping[str, str]] = None,
+    print_query: bool = False,
+    # Layout:
+    prompt: str = '> ',
+    ansi: bool = False,
+    header: str = '',
+    preview: Optional[Union[str, Callable[[Any], AnyStr]]] = None,
+    tmux: Optional[Union[str, bool]] = False,
+    # Misc:
+    query: str = '',
+    cycle: bool = False,
+    __extra__: Iterable[str] = (),
+    encoding: Optional[str] = None,
+    executable: Optional[PathLike] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_latency: float = DEFAULT_BATCH_LATENCY,
+    display: Optional[Callable[[Any], AnyStr]] = None,
+    read0: bool = False,
+    newline_policy: Literal['raise', 'replace', 'skip', 'escape'] = 'raise',
+    lazy: bool = False,
+    threaded: bool = False,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    on_stats: Optional[Callable[['FzfStats'], Any]] = None,
+    source: Optional[Callable[[str], Iterable[Any]]] = None,
+    max_items: Optional[int] = None,
+    timeout: Optional[float] = None,
+    dedupe: Union[bool, 'BloomFilter', MutableSet[Any]] = False,
+    key: Optional[Callable[[Any], Hashable]] = None,
+    score: Optional[Callable[[Any], Any]] = None,
+    top_k: Optional[int] = None,
+    tail: Optional[int] = None,
+    rate_limit: Optional[float] = None,
+    byte_rate_limit: Optional[float] = None,
+    eager_start: bool = False,
+    loading_header: str = 'Loading...'
+):
+    started = monotonic()
+    check_bounds(max_items, timeout)
+    check_rate_limits(tail, rate_limit, byte_rate_limit)
+    if top_k is not None:
+        if score is None:
+            raise ValueError('top_k requires score')
+        elif top_k < 1:
+            raise ValueError('top_k must be 1 or more: ' + repr(top_k))
+    if iterable is None and source is not None:
+        iterable = source(query)
+    if isinstance(iterable, CandidateSet):
+        read0 = iterable.read0
+    check_newline_policy(newline_policy)
+    encoding = encoding or sys.getdefaultencoding()
+    table = None
+    # Only the elements of the items fzf keeps are kept in tail mode:
+    new_table = list if tail is None else functools.partial(TailTable, tail)
+    servers = []  # Callback servers to stop once fzf exits
+
+    def new_seen() -> Union[BloomFilter, MutableSet[Any]]:
+        # Every reload of the source starts from scratch, as a shared filter
+        # would drop all candidates it has seen before:
+        if isinstance(dedupe, BloomFilter):
+            return BloomFilter(dedupe.capacity, dedupe.error_rate)
+        return set()
+
+    def prepare(
+        items: Iterable[Any],
+        seen: Optional[Union[BloomFilter, MutableSet[Any]]] = None,
+        records: Optional[List[Any]] = None
+    ) -> Iterable[AnyStr]:
+        # Duplicates are dropped first, so that they take no place in top_k.
+        # Note that an empty set is falsy, but still means to dedupe:
+        if dedupe is not False:
+            if seen is None:
+                seen = set() if dedupe is True else dedupe
+            items = iter_unique(items, seen, key)
+        if score is not None:
+            if top_k is None:
+                items = sorted(items, key=score, reverse=True)
+            else:
+                import heapq
+                items = heapq.nlargest(top_k, items, key=score)
+        if display is not None:
+            items = iter_with_index(
+                items, display, table if records is None else records
+            )
+        return items
+
+    column = encode_column(
+        iterable,
+        encoding=encoding,
+        read0=read0,
+        newline_policy=newline_policy
+    )
+    raw = column is not None or \
+        isinstance(iterable, (CandidateSet, ) + RAW_INPUT_TYPES)
+    if raw and (
+        display is not None or dedupe is not False or score is not None
+    ):
+        raise TypeError(
+            'display, dedupe, and score cannot be used with a file, '
+            'a buffer, or an array: ' + repr(iterable)
+        )
+    # Raw inputs are passed to fzf right away anyway:
+    eager_start = eager_start and not raw
+    # The result event was introduced in fzf 0.46.0; an unknown version is
+    # assumed to be recent:
+    loading = eager_start and \
+        (fzf_version(executable) or (0, 46)) >= (0, 46)
+    if loading:
+        # fzf triggers the result event once it has matched the items read,
+        # which replaces the loading header with the actual one:
+        restore = format_action('change-header', header)
+        bind = dict(bind or {})
+        bind['result'] = restore + '+' + bind['result'] \
+            if 'result' in bind else restore
+
+    # Callback servers are started once the options are validated, and are
+    # closed if anything goes wrong until fzf takes over:
+    def close_servers() -> None:
+        for server in servers:
+            server.close()
+
+    if callable(preview):
+
+        def resolve(line: bytes) -> Any:
+            if table is not None:
+                return table[int(line[:line.index(b'\t')])]
+            return line if byte else line.decode(encoding)
+
+        preview_server = PreviewServer(preview, resolve, encoding=encoding)
+        preview_server.start()
+        servers.append(preview_server)
+        preview = preview_server.command('{f}', from_file=True)
+    if source is not None:
+        source_server = SourceServer(
+            source,
+            lambda items, records: prepare(items, new_seen(), records),
+            new_table=new_table,
+            encoding=encoding,
+            read0=read0,
+            newline_policy=newline_policy,
+            batch_size=batch_size,
+            batch_latency=batch_latency,
+        )
+        source_server.start()
+        servers.append(source_server)
+        reload = format_action('reload', source_server.command('{q}'))
+        bind = dict(bind or {})
+        bind['change'] = reload + '+' + bind['change'] \
+            if 'change' in bind else reload
+
+    proc = None
+    stdin = None
+    byte = None
+    # Statistics are counted per batch rather than per item, so that they
+    # cost next to nothing even if no one is interested in them:
+    spawn_seconds = write_seconds = flush_seconds = 0.0
+    items_fed = bytes_fed = 0
+    broken_pipe = False
+    try:
+        cmd = build_command(
+            sort=sort,
+            extended=extended,
+            exact=exact,
+            case_sensitive=case_sensitive,
+            multi=multi,
+            mouse=mouse,
+            bind=bind,
+            color=color,
+            print_query=print_query,
+            prompt=prompt,
+            ansi=ansi,
+            header=loading_header if loading else header,
+            preview=preview,
+            tmux=tmux,
+            query=query,
+            cycle=cycle,
+            __extra__=__extra__,
+            executable=executable,
+            read0=read0,
+            tail=tail,
+        )
+        if raw:
+            feed = None
+            rows = 0  # Lines of files and buffers are not counted
+            if column is not None:
+                # Selected lines are mapped to their row indices:
+                payload, rows, byte = column
+                table = range(rows)
+                cmd.extend(index_options(cmd))
+                if rows:
+                    feed = feed_raw_input(cmd, payload, len(payload))
+            elif isinstance(iterable, CandidateSet):
+                # Written at once, and fzf is not spawned at all if empty:
+                buffer = iterable.buffer
+                rows = len(iterable)
+                if len(buffer):
+                    feed = feed_raw_input(cmd, buffer, len(buffer))
+                byte = iterable.byte
+                encoding = iterable.encoding
+            else:
+                feed = feed_raw_input(cmd, iterable, batch_size)
+                byte = True
+            if feed is not None:
+                proc = feed.proc
+                spawn_seconds = feed.spawn_seconds
+                write_seconds = feed.write_seconds
+                bytes_fed = feed.bytes_fed or 0
+                broken_pipe = feed.broken_pipe
+                # Rows cut off in the middle are not counted either:
+                items_fed = 0 if broken_pipe else rows
+            iterable = ()
+            threaded = False
+        if display is not None:
+            table = new_table()
+            cmd.extend(index_options(cmd))
+        iterable = prepare(iterable)
+        if display is not None and source is not None:
+            # Once the source is reloaded, selected lines refer to the table
+            # of its latest generation instead:
+            table = GenerationTable(table, source_server)
+    except BaseException:
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+        close_servers()
+        raise
+    batch = []
+    batch_bytes = 0
+    flushed_at = None
+
+    def spawn() -> None:
+        nonlocal proc, stdin, spawn_seconds
+        import subprocess
+        spawn_started = monotonic()
+        proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None
+        )
+        stdin = proc.stdin
+        spawn_seconds = monotonic() - spawn_started
+
+    def flush(batch) -> bool:
+        nonlocal write_seconds, flush_seconds, items_fed, bytes_fed, \
+            broken_pipe
+        flush_started = monotonic()
+        if tail is not None and len(batch) > tail:
+            batch = batch[-tail:]  # fzf would discard the rest anyway
+        chunk = encode_batch(
+            batch,
+            byte=byte,
+            encoding=encoding,
+            read0=read0,
+            newline_policy=newline_policy,
+        )
+        if not chunk:
+            flush_seconds += monotonic() - flush_started
+            return True
+        if proc is None:
+            spawn()
+        write_started = monotonic()
+        broken_pipe = not write_chunk(stdin, chunk)
+        finished = monotonic()
+        write_seconds += finished - write_started
+        flush_seconds += finished - flush_started
+        items_fed += len(batch)
+        bytes_fed += len(chunk)
+        # fzf may have exited without reading the whole input, e.g., -1:
+        return not broken_pipe and proc.poll() is None
+
+    if threaded:
+        iterable = iter_in_thread(iterable, queue_size, batch_latency or None)
+    deadline = float('inf') if timeout is None else started + timeout
+    taken = 0
+    exhausted = False
+    throttled_until = 0.0
+    try:
+        if eager_start:
+            # fzf sets up the terminal while the first item is computed:
+            spawn()
+        loop_started = monotonic()
+        for line in iterable:
+            now = monotonic()
+            if line is not None:
+                if byte is None:
+                    byte = isinstance(line, bytes)
+                batch.append(line)
+                batch_bytes += len(line) + 1
+                taken += 1
+            elif not batch:
+                # While the producer thread is idle, fzf may have exited:
+                if now >= deadline or \
+                        proc is not None and proc.poll() is not None:
+                    break
+                continue
+            last = taken == max_items or now >= deadline
+            full = batch_bytes >= batch_size
+            # The first item is flushed immediately so that fzf can show it
+            # without waiting for the rest of a slow stream.  None means
+            # the producer thread is idle, so the pending batch is flushed:
+            if last or full or line is None or flushed_at is None or \
+                    now - flushed_at >= batch_latency:
+                if now < throttled_until:
+                    # Rate limited; coalesces items into the next flush, and
+                    # holds the iterable back once the batch is full:
+                    if not (last or full):
+                        continue
+                    time.sleep(throttled_until - now)
+                    flush_seconds += throttled_until - now
+                    now = throttled_until
+                fed = items_fed, bytes_fed
+                if not flush(batch) or last:
+                    break
+                throttled_until = now + rate_interval(
+                    items_fed - fed[0],
+                    bytes_fed - fed[1],
+                    rate_limit,
+                    byte_rate_limit,
+                )
+                batch = []
+                batch_bytes = 0
+                flushed_at = now
+        else:
+            exhausted = True
+            if batch:
+                now = monotonic()
+                if now < throttled_until:
+                    time.sleep(throttled_until - now)
+                flush(batch)
+        if proc is None and source is not None:
+            # The source may have nothing for the initial query (e.g., it
+            # waits for a few characters), but fills fzf as the query changes:
+            spawn()
+    except BaseException:
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+        close_servers()
+        raise
+    finally:
+        # Stops the producer thread, or the iterable if it is cut off, e.g.,
+        # fzf has exited or a bound is reached, so that it can release its
+        # resources right away:
+        if threaded or not exhausted:
+            close_iterable(iterable)
+    iterable_seconds = monotonic() - loop_started - flush_seconds
+
+    def report(exit_code: Optional[int]) -> None:
+        if on_stats is not None:
+            on_stats(
+                FzfStats(
+                    spawn_seconds=spawn_seconds,
+                    items_fed=items_fed,
+                    bytes_fed=bytes_fed,
+                    write_seconds=write_seconds,
+                    iterable_seconds=iterable_seconds,
+                    broken_pipe=broken_pipe,
+                    exit_code=exit_code,
+                    total_seconds=monotonic() - started,
+                )
+            )
+
+    if stdin is not None:
+        close_stdin(stdin)
+    if eager_start and source is None and not items_fed and \
+            proc.poll() is None:
+        # The iterable turned out to be empty; fzf is closed as if it had
+        # never been spawned, so that nothing is chosen as usual:
+        proc.terminate()
+        proc.wait()
+        proc.stdout.close()
+        proc = None
+    if lazy:
+        report(None)
+        if proc is None:
+            close_servers()
+            return (None, iter(())) if print_query else iter(())
+        lines = iter_lines(proc.stdout, b'\0' if read0 else b'\n')
+        output = iter_output(
+            proc,
+            lines,
+            byte=byte,
+            encoding=encoding,
+            table=table,
+            on_exit=close_servers,
+        )
+        if print_query:
+            query = next(lines, None)
+            if query is not None:
+                return (query if byte else query.decode(encoding)), output
+            next(output, None)  # Reaps fzf, and raises KeyboardInterrupt
+            return None, None
+        return output
+    # The output has to be read before waiting, or fzf would get blocked
+    # on writing an output larger than the pipe buffer:
+    output = proc.stdout.read() if proc else b''
+    exit_code = proc.wait() if proc else -1
+    close_servers()
+    report(exit_code)
+    return parse_output(
+        exit_code,
+        output,
+        byte=byte,
+        encoding=encoding,
+        multi=multi,
+        print_query=print_query,
+        read0=read0,
+        table=table,
+    )
+
+
+async def aiterfzf(
+    iterable: AsyncIterable[AnyStr],
+    *,
+    # Sorting:
+    sort: bool = False,
+    # Search mode:
+    extended: bool = True,
+    exact: bool = False,
+    case_sensitive: Optional[bool] = None,
+    # Interface:
+    multi: bool = False,
+    mouse: bool = True,
+    bind: Optional[Mapping[str, str]] = None,
+    color: Optional[Mapping[str, str]] = None,
+    print_query: bool = False,
+    # Layout:
+    prompt: str = '> ',
+    ansi: bool = False,
+    header: str = '',
+    preview: Optional[Union[str, Callable[[Any], AnyStr]]] = None,
+    tmux: Optional[Union[str, bool]] = False,
+    # Misc:
+    query: str = '',
+    cycle: bool = False,
+    __extra__: Iterable[str] = (),
+    encoding: Optional[str] = None,
+    executable: Optional[PathLike] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_latency: float = DEFAULT_BATCH_LATENCY,
+    display: Optional[Callable[[Any], AnyStr]] = None,
+    read0: bool = False,
+    newline_policy: Literal['raise', 'replace', 'skip', 'escape'] = 'raise',
+    on_stats: Optional[Callable[[FzfStats], Any]] = None,
+    max_items: Optional[int] = None,
+    timeout: Optional[float] = None,
+    tail: Optional[int] = None,
+    rate_limit: Optional[float] = None,
+    byte_rate_limit: Optional[float] = None
+):
+    """The asynchronous version of :func:`iterfzf()`.  It consumes the given
+    asynchronous ``iterable`` and waits for ``fzf`` without blocking the event
+    loop.  It takes the same options as :func:`iterfzf()` except for
+    ``threaded``, ``queue_size``, ``lazy``, ``source``, ``dedupe``, ``key``,
+    ``score``, ``top_k``, ``eager_start``, and ``loading_header``.
+    """
+    # asyncio is imported here since it takes a while to import, and
+    # the most users of iterfzf() do not need it:
+    import asyncio
+    started = monotonic()
+    check_bounds(max_items, timeout)
+    check_rate_limits(tail, rate_limit, byte_rate_limit)
+    check_newline_policy(newline_policy)
+    cmd = build_command(
+        sort=sort,
+        extended=extended,
+        exact=exact,
+        case_sensitive=case_sensitive,
+        multi=multi,
+        mouse=mouse,
+        bind=bind,
+        color=color,
+        print_query=print_query,
+        prompt=prompt,
+        ansi=ansi,
+        header=header,
+        preview=None if callable(preview) else preview,
+        tmux=tmux,
+        query=query,
+        cycle=cycle,
+        __extra__=__extra__,
+        executable=executable,
+        read0=read0,
+        tail=tail,
+    )
+    table = None
+    if display is not None:
+        table = [] if tail is None else TailTable(tail)
+        iterable = aiter_with_index(iterable, display, table)
+        cmd.extend(index_options(cmd))
+    encoding = encoding or sys.getdefaultencoding()
+    proc = None
+    stdin = None
+    byte = None
+    preview_server = None
+    if callable(preview):
+
+        def resolve(line: bytes) -> Any:
+            if table is not None:
+                return table[int(line[:line.index(b'\t')])]
+            return line if byte else line.decode(encoding)
+
+        preview_server = PreviewServer(preview, resolve, encoding=encoding)
+        preview_server.start()
+        cmd.append(
+            '--preview=' + preview_server.command('{f}', from_file=True)
+        )
+    batch = []
+    batch_bytes = 0
+    flushed_at = None
+    spawn_seconds = write_seconds = flush_seconds = 0.0
+    items_fed = bytes_fed = 0
+    broken_pipe = False
+
+    async def flush(batch) -> bool:
+        nonlocal proc, stdin, spawn_seconds, write_seconds, flush_seconds, \
+            items_fed, bytes_fed, broken_pipe
+        flush_started = monotonic()
+        if tail is not None and len(batch) > tail:
+            batch = batch[-tail:]
+        chunk = encode_batch(
+            batch,
+            byte=byte,
+            encoding=encoding,
+            read0=read0,
+            newline_policy=newline_policy,
+        )
+        if not chunk:
+            flush_seconds += monotonic() - flush_started
+            return True
+        if proc is None:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=None
+            )
+            stdin = proc.stdin
+            spawn_seconds = monotonic() - flush_started
+        write_started = monotonic()
+        broken_pipe = not await write_chunk_async(stdin, chunk)
+        finished = monotonic()
+        write_seconds += finished - write_started
+        flush_seconds += finished - flush_started
+        items_fed += len(batch)
+        bytes_fed += len(chunk)
+        return not broken_pipe and proc.returncode is None
+
+    deadline = float('inf') if timeout is None else started + timeout
+    taken = 0
+    throttled_until = 0.0
+    try:
+        loop_started = monotonic()
+        async for line in iterable:
+            if byte is None:
+                byte = isinstance(line, bytes)
+            batch.append(line)
+            batch_bytes += len(line) + 1
+            taken += 1
+            now = monotonic()
+            last = taken == max_items or now >= deadline
+            full = batch_bytes >= batch_size
+            if last or full or flushed_at is None or \
+                    now - flushed_at >= batch_latency:
+                if now < throttled_until:
+                    if not (last or full):
+                        continue
+                    await asyncio.sleep(throttled_until - now)
+                    flush_seconds += throttled_until - now
+                    now = throttled_until
+                fed = items_fed, bytes_fed
+                if not await flush(batch) or last:
+                    # Lets the iterable release its resources right away:
+                    await aclose_iterable(iterable)
+                    break
+                throttled_until = now + rate_interval(
+                    items_fed - fed[0],
+                    bytes_fed - fed[1],
+                    rate_limit,
+                    byte_rate_limit,
+                )
+                batch = []
+                batch_bytes = 0
+                flushed_at = now
+        else:
+            if batch:
+                now = monotonic()
+                if now < throttled_until:
+                    await asyncio.sleep(throttled_until - now)
+                await flush(batch)
+        iterable_seconds = monotonic() - loop_started - flush_seconds
+        if stdin is not None:
+            stdin.close()
+            try:
+                await stdin.wait_closed()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        if proc is None:
+            output = b''
+            exit_code = -1
+        else:
+            output = await proc.stdout.read()
+            exit_code = await proc.wait()
+    finally:
+        # E.g., the task is cancelled or the iterable raised an error:
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if preview_server is not None:
+            preview_server.close()
+    if on_stats is not None:
+        on_stats(
+            FzfStats(
+                spawn_seconds=spawn_seconds,
+                items_fed=items_fed,
+                bytes_fed=bytes_fed,
+                write_seconds=write_seconds,
+                iterable_seconds=iterable_seconds,
+                broken_pipe=broken_pipe,
+                exit_code=exit_code,
+                total_seconds=monotonic() - started,
+            )
+        )
+    return parse_output(
+        exit_code,
+        output,
+        byte=byte,
+        encoding=encoding,
+        multi=multi,
+        print_query=print_query,
+        read0=read0,
+        table=table,
+    )
+
+
+# Note that this function is not exported by __all__, as it would shadow
+# the built-in filter() function through "from iterfzf import *".
+def filter(
+    iterable: Iterable[AnyStr],
+    query: str,
+    *,
+    limit: Optional[int] = None,
+    jobs: int = 1,
+    # Sorting:
+    sort: bool = True,
+    # Search mode:
+    extended: bool = True,
+    exact: bool = False,
+    case_sensitive: Optional[bool] = None,
+    # Misc:
+    ansi: bool = False,
+    read0: bool = False,
+    newline_policy: Literal['raise', 'replace', 'skip', 'escape'] = 'raise',
+    __extra__: Iterable[str] = (),
+    encoding: Optional[str] = None,
+    executable: Optional[PathLike] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Generator[AnyStr, None, None]:
+    """Ranks the elements of the ``iterable`` matching the ``query`` using
+    ``fzf --filter``, without any user interface.  Yields the matched
+    elements in the order of their ranks (or in the order of the ``iterable``
+    if ``sort`` is ``False``) as they are read from ``fzf``.  Up to ``limit``
+    elements are yielded if it is given.
+
+    If ``jobs`` is more than 1, the elements are sharded across that many
+    ``fzf`` processes.  Their outputs are merged by ranking them once again
+    with another ``fzf`` process, which is usually much cheaper than
+    the first pass since it takes only the matched elements (up to ``limit``
+    for each shard).  Note that nothing is yielded until every shard has
+    finished, and if ``sort`` is ``False`` the elements are yielded shard by
+    shard, i.e., not in the order of the ``iterable``.
+
+    The other options are the same as :func:`iterfzf()`.
+    """
+    import subprocess
+    if jobs < 1:
+        raise ValueError('jobs must be 1 or more: ' + repr(jobs))
+    check_newline_policy(newline_policy)
+    cmd = build_command(
+        sort=sort,
+        extended=extended,
+        exact=exact,
+        case_sensitive=case_sensitive,
+        ansi=ansi,
+        __extra__=__extra__,
+        executable=executable,
+        read0=read0,
+    )
+    cmd.append('--filter=' + query)
+    encoding = encoding or sys.getdefaultencoding()
+    delimiter = b'\0' if read0 else b'\n'
+    iterator = iter(iterable)
+    for first in iterator:
+        byte = isinstance(first, bytes)
+        break
+    else:
+        return
+    procs = [
+        subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        for _ in range(jobs)
+    ]
+    errors = []
+
+    def feed():
+        import itertools
+        chunks = encode_batches(
+            itertools.chain([first], iterator),
+            encoding=encoding,
+            read0=read0,
+            newline_policy=newline_policy,
+            batch_size=batch_size,
+        )
+        try:
+            # Batches are distributed over shards in turn:
+            for shard, (_, chunk) in enumerate(chunks):
+                if not write_chunk(procs[shard % jobs].stdin, chunk):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            for proc in procs:
+                close_stdin(proc.stdin)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        if jobs == 1:
+            lines = iter_lines(procs[0].stdout, delimiter)
+        else:
+            # Outputs have to be read concurrently, or a shard blocked on
+            # writing its output would block the feeder as well:
+            outputs = [None] * jobs
+
+            def read(i):
+                outputs[i] = procs[i].stdout.read().split(delimiter)[:-1]
+
+            readers = [
+                threading.Thread(target=read, args=(i, ), daemon=True)
+                for i in range(jobs)
+            ]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            if sort:
+                candidates = []
+                for output in outputs:
+                    candidates.extend(output[:limit])
+                candidates.append(b'')
+                merged = subprocess.run(
+                    cmd,
+                    input=delimiter.join(candidates),
+                    stdout=subprocess.PIPE
+                ).stdout
+                lines = merged.split(delimiter)[:-1]
+            else:
+                # Shards do not tell which batches their lines came from, so
+                # their outputs cannot be interleaved back into the order of
+                # the iterable:
+                lines = (line for output in outputs for line in output)
+            if not read0:
+                lines = (line.rstrip(b'\r') for line in lines)
+        for i, line in enumerate(lines):
+            if limit is not None and i >= limit:
+                break
+            yield line if byte else line.decode(encoding)
+        else:
+            feeder.join()
+            if errors:
+                raise errors[0]
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+
+
+# Pairs of delimiters fzf accepts around action arguments, e.g., reload(...),
+# reload[...], reload~...~:
+ACTION_DELIMITERS: Sequence[Tuple[str, str]] = (
+    ('(', ')'),
+    ('[', ']'),
+    ('{', '}'),
+    ('<', '>'),
+    ('~', '~'),
+    ('!', '!'),
+    ('@', '@'),
+    ('#', '#'),
+    ('$', '$'),
+    ('%', '%'),
+    ('^', '^'),
+    ('&', '&'),
+    ('*', '*'),
+    (';', ';'),
+    ('/', '/'),
+    ('|', '|'),
+)
+
+
+def iterfzf_table(
+    rows: Iterable[Any],
+    columns: Optional[Sequence[Hashable]] = None,
+    *,
+    match: Optional[Sequence[Hashable]] = None,
+    sample_size: int = 1000,
+    **options
+):
+    """Shows the ``rows`` (mappings or sequences, e.g., dicts or tuples) as
+    a table of aligned columns, and returns the chosen rows as the original
+    row objects.
+
+    The ``columns`` are the keys (or indices) of the fields to show, in that
+    order.  All fields of the first row are shown by default.  For mappings,
+    the column names are shown as the ``header`` unless it is given.
+    The widths of the columns are measured in a single pass over a sample of
+    up to ``sample_size`` rows (spread over the rows if they are
+    a sequence), so that ``fzf`` gets the first rows without waiting for all
+    of them.  Cells wider than the sample are not truncated.
+
+    Each row is written as tab-delimited fields, and only the ``match``
+    columns (all shown columns by default) are searched by ``fzf`` through
+    its ``--nth`` option.  Cells must not contain tabs.
+
+    The other options are the same as :func:`iterfzf()`, except for
+    ``display``.
+    """
+    import itertools
+    import operator
+    if sample_size < 1:
+        raise ValueError('sample_size must be 1 or more: ' + repr(sample_size))
+    if isinstance(rows, Sequence):
+        step = max(len(rows) // sample_size, 1)
+        sample = [rows[i] for i in range(0, len(rows), step)][:sample_size]
+    else:
+        rows = iter(rows)
+        sample = list(itertools.islice(rows, sample_size))
+        rows = itertools.chain(sample, rows)
+    if not sample:
+        return iterfzf((), **options)
+    if columns is None:
+        first = sample[0]
+        columns = list(first) if isinstance(first, Mapping) \
+            else list(range(len(first)))
+    if match is None:
+        nth = None
+    else:
+        try:
+            nth = ','.join(str(columns.index(c) + 1) for c in match)
+        except ValueError:
+            raise ValueError(
+                'match must be a subset of columns: {0!r} not in {1!r}'.format(
+                    match, columns
+                )
+            ) from None
+    if len(columns) == 1:
+        column, = columns
+
+        def cells(row: Any) -> Tuple[Any, ...]:
+            return row[column],
+    else:
+        cells = operator.itemgetter(*columns)
+    widths = [0] * len(columns)
+    if isinstance(sample[0], Mapping) and 'header' not in options:
+        names = [str(c) for c in columns]
+        widths = [len(n) for n in names]
+    else:
+        names = None
+    for row in sample:
+        widths = [max(w, len(str(c))) for w, c in zip(widths, cells(row))]
+    # As fzf is given --tabstop=1, every tab is shown as a single space, and
+    # the cells are padded to be one space apart:
+    template = '\t'.join(
+        ['{!s:<%d}' % (w + 1) for w in widths[:-1]] + ['{!s}']
+    )
+    if names is not None:
+        options['header'] = template.format(*names).replace('\t', ' ')
+    extra = list(options.pop('__extra__', ()))
+    extra.append('--tabstop=1')
+    if nth is not None:
+        # Field indices of --nth are based on the result of --with-nth,
+        # which hides the index prefixed to each line:
+        extra.append('--nth=' + nth)
+    return iterfzf(
+        rows,
+        display=lambda row: template.format(*cells(row)),
+        __extra__=extra,
+        **options
+    )
+
+
+def format_action(name: str, argument: str) -> str:
+    """Formats an ``fzf`` action with the ``argument``, e.g.,
+    ``change-prompt(> )``, choosing delimiters which do not appear in
+    the ``argument``.
+    """
+    for opening, closing in ACTION_DELIMITERS:
+        if closing not in argument:
+            return name + opening + argument + closing
+    raise ValueError(
+        'cannot find delimiters for the argument of {0}: {1!r}'.format(
+            name, argument
+        )
+    )
+
+
+def quote_path(path: PathLike) -> str:
+    """Quotes the ``path`` for the shell ``fzf`` runs commands with."""
+    if sys.platform == 'win32':
+        return '"{0}"'.format(fspath(path))
+    import shlex
+    return shlex.quote(fspath(path))
+
+
+class FzfSession:
+    """A long-running ``fzf`` process which can prompt a user many times
+    without respawning.  It listens on a local port (``--listen``), and
+    each prompt pushes a new candidate set through the HTTP API with
+    ``reload`` and ``change-prompt`` actions.  Pressing enter (or calling
+    :meth:`accept()`) reports the chosen items back to the session rather
+    than exiting ``fzf``.
+
+    .. code-block:: python
+
+       with FzfSession() as session:
+           host = session.prompt(hosts, prompt='host> ')
+           path = session.prompt(list_paths(host), prompt='path> ')
+
+    If ``headless`` is ``True``, ``fzf`` is attached to a private
+    pseudo-terminal instead of the current terminal (POSIX only), so that
+    the session can be driven only through its methods, e.g., in tests.
+
+    The other options are the same as :func:`iterfzf()`.
+    """
+
+    #: How long to wait for ``fzf`` to start listening, in seconds.
+    startup_timeout: float = 10.0
+
+    def __init__(
+        self,
+        *,
+        sort: bool = False,
+        extended: bool = True,
+        exact: bool = False,
+        case_sensitive: Optional[bool] = None,
+        multi: bool = False,
+        mouse: bool = True,
+        bind: Optional[Mapping[str, str]] = None,
+        color: Optional[Mapping[str, str]] = None,
+        prompt: str = '> ',
+        ansi: bool = False,
+        header: str = '',
+        preview: Optional[str] = None,
+        cycle: bool = False,
+        __extra__: Iterable[str] = (),
+        encoding: Optional[str] = None,
+        executable: Optional[PathLike] = None,
+        headless: bool = False
+    ):
+        self.options = dict(
+            sort=sort,
+            extended=extended,
+            exact=exact,
+            case_sensitive=case_sensitive,
+            multi=multi,
+            mouse=mouse,
+            bind=bind,
+            color=color,
+            prompt=prompt,
+            ansi=ansi,
+            header=header,
+            preview=preview,
+            cycle=cycle,
+            __extra__=__extra__,
+            executable=executable,
+        )
+        self.multi = multi
+        self.encoding = encoding or sys.getdefaultencoding()
+        self.headless = headless
+        self.byte = False
+        self.proc = None
+        self.port = None
+        self.api_key = None
+        self.directory = None
+        self.tty = None
+
+    def __enter__(self) -> 'FzfSession':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def candidates_path(self) -> Path:
+        from pathlib import Path
+        return Path(self.directory.name) / 'candidates'
+
+    @property
+    def result_path(self) -> Path:
+        from pathlib import Path
+        return Path(self.directory.name) / 'result'
+
+    def start(self) -> None:
+        """Spawns ``fzf``, and waits until it starts listening."""
+        import secrets
+        import subprocess
+        import socket
+        import tempfile
+        if self.proc is not None:
+            raise RuntimeError('the session is already started')
+        self.directory = tempfile.TemporaryDirectory(prefix='iterfzf-')
+        self.candidates_path.write_bytes(b'')
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.api_key = secrets.token_hex(16)
+        env = dict(os.environ, FZF_API_KEY=self.api_key)
+        result = quote_path(self.result_path)
+        tmp = quote_path(self.result_path.with_suffix('.tmp'))
+        if sys.platform == 'win32':
+            report = 'copy /y {{+f}} {0} >nul && move /y {0} {1} >nul'
+            cancel = 'type nul > {0} && move /y {0} {1} >nul'
+            reload = 'type {0}'
+        else:
+            report = 'cat {{+f}} > {0} && mv {0} {1}'
+            cancel = ': > {0} && mv {0} {1}'
+            reload = 'cat {0}'
+        self.accept_action = format_action(
+            'execute-silent', report.format(tmp, result)
+        )
+        self.cancel_action = format_action(
+            'execute-silent', cancel.format(tmp, result)
+        )
+        self.reload_command = reload.format(quote_path(self.candidates_path))
+        bind = dict(self.options['bind'] or {})
+        bind.setdefault('enter', self.accept_action)
+        for key in 'esc', 'ctrl-c', 'ctrl-g', 'ctrl-q':
+            bind.setdefault(key, self.cancel_action)
+        cmd = build_command(**dict(self.options, bind=bind))
+        cmd.append('--listen={0}'.format(self.port))
+        preexec_fn = None
+        if self.headless:
+            import pty
+            self.tty, slave = pty.openpty()
+            preexec_fn = functools.partial(take_controlling_terminal, slave)
+            # The output to the pseudo-terminal has to be drained, or fzf
+            # would get blocked:
+            threading.Thread(target=drain_fd, args=(self.tty, ),
+                             daemon=True).start()
+        try:
+            self.proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                env=env,
+                preexec_fn=preexec_fn,
+            )
+        finally:
+            if self.headless:
+                os.close(slave)
+        deadline = monotonic() + self.startup_timeout
+        while True:
+            try:
+                self.state(limit=0)
+            except OSError:
+                if self.proc.poll() is not None:
+                    self.close()
+                    raise RuntimeError('fzf exited before listening')
+                elif monotonic() > deadline:
+                    self.close()
+                    raise TimeoutError('fzf did not start listening')
+                time.sleep(0.01)
+            else:
+                break
+
+    def request(
+        self,
+        method: str,
+        path: str = '/',
+        body: Optional[bytes] = None
+    ) -> bytes:
+        """Sends an HTTP request to the API of ``fzf``."""
+        import http.client
+        if self.proc is None:
+            raise RuntimeError('the session is not started')
+        conn = http.client.HTTPConnection('localhost', self.port, timeout=5)
+        try:
+            conn.request(
+                method, path, body=body, headers={'X-Api-Key': self.api_key}
+            )
+            response = conn.getresponse()
+            data = response.read()
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(
+                'fzf responded with {0}: {1!r}'.format(response.status, data)
+            )
+        return data
+
+    def send(self, *actions: str) -> None:
+        """Makes ``fzf`` to perform the ``actions``, e.g.,
+        ``session.send('first', 'toggle')``.
+        """
+        self.request('POST', body='+'.join(actions).encode('utf-8'))
+
+    def state(self, limit: int = 100) -> Mapping[str, Any]:
+        """Gets the current state of ``fzf``, e.g., ``query``,
+        ``matchCount``, and ``matches`` (up to ``limit``).
+        """
+        import json
+        return json.loads(self.request('GET', '/?limit={0}'.format(limit)))
+
+    def load(
+        self,
+        iterable: Iterable[AnyStr],
+        *,
+        prompt: Optional[str] = None,
+        query: Optional[str] = None,
+        newline_policy: Literal['raise', 'replace', 'skip',
+                                'escape'] = 'raise',
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        timeout: Optional[float] = None
+    ) -> None:
+        """Replaces the candidates with the ``iterable``, and optionally
+        the ``prompt`` and the ``query`` too.  Waits until ``fzf`` finishes
+        reading the candidates.
+        """
+        check_newline_policy(newline_policy)
+        self.discard_result()
+        tmp = self.candidates_path.with_suffix('.tmp')
+        byte = None
+        count = 0
+        with tmp.open('wb') as f:
+            for batch, chunk in encode_batches(
+                iterable,
+                encoding=self.encoding,
+                newline_policy=newline_policy,
+                batch_size=batch_size,
+            ):
+                if byte is None:
+                    byte = isinstance(batch[0], bytes)
+                count += chunk.count(b'\n')
+                f.write(chunk)
+        # The file is replaced at once, so that fzf never reads it partially:
+        os.replace(tmp, self.candidates_path)
+        self.byte = bool(byte)
+        actions = [format_action('reload', self.reload_command)]
+        if prompt is not None:
+            actions.append(format_action('change-prompt', prompt))
+        if query is not None:
+            actions.append(format_action('change-query', query))
+        self.send(*actions)
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            state = self.state(limit=0)
+            if not state['reading'] and state['totalCount'] == count and \
+                    (query is None or state['query'] == query):
+                break
+            elif deadline is not None and monotonic() > deadline:
+                raise TimeoutError('fzf did not finish reading candidates')
+            time.sleep(0.01)
+
+    def accept(self) -> None:
+        """Chooses the current item (or the selected items), as if a user
+        pressed enter.
+        """
+        self.send(self.accept_action)
+
+    def cancel(self) -> None:
+        """Cancels the current prompt, as if a user pressed escape."""
+        self.send(self.cancel_action)
+
+    def discard_result(self) -> None:
+        try:
+            self.result_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def wait(self, timeout: Optional[float] = None):
+        """Waits until a user chooses something, and returns it in the same
+        way as :func:`iterfzf()`.  Returns ``None`` if the user cancelled
+        or nothing matched.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            try:
+                output = self.result_path.read_bytes()
+            except FileNotFoundError:
+                if self.proc.poll() is not None:
+                    raise RuntimeError(
+                        'fzf exited with {0}'.format(self.proc.returncode)
+                    )
+                elif deadline is not None and monotonic() > deadline:
+                    raise TimeoutError('no choice has been made')
+                time.sleep(0.01)
+            else:
+                break
+        self.discard_result()
+        return parse_output(
+            0 if output else 1,
+            output,
+            byte=self.byte,
+            encoding=self.encoding,
+            multi=self.multi,
+            print_query=False,
+        )
+
+    def prompt(
+        self,
+        iterable: Iterable[AnyStr],
+        *,
+        prompt: Optional[str] = None,
+        query: Optional[str] = '',
+        newline_policy: Literal['raise', 'replace', 'skip',
+                                'escape'] = 'raise',
+        timeout: Optional[float] = None
+    ):
+        """Shows the candidates from the ``iterable``, and waits until
+        a user chooses something.  See also :meth:`load()` and
+        :meth:`wait()`.
+        """
+        self.load(
+            iterable,
+            prompt=prompt,
+            query=query,
+            newline_policy=newline_policy,
+            timeout=timeout,
+        )
+        return self.wait(timeout=timeout)
+
+    def close(self) -> None:
+        """Terminates ``fzf``, and cleans up the session."""
+        import subprocess
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.terminate()
+                try:
+                    self.proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.proc.kill()
+                    self.proc.wait()
+            self.proc = None
+        if self.tty is not None:
+            os.close(self.tty)
+            self.tty = None
+        if self.directory is not None:
+            self.directory.cleanup()
+            self.directory = None
+
+
+def take_controlling_terminal(fd: int) -> None:
+    """Makes the pseudo-terminal ``fd`` the controlling terminal of a new
+    session, so that ``fzf`` can open it as :file:`/dev/tty`.  This is run
+    in the child process.
+    """
+    import fcntl
+    import termios
+    os.setsid()
+    fcntl.ioctl(fd, termios.TIOCSCTTY, 0)
+
+
+def drain_fd(fd: int) -> None:
+    """Reads and discards everything from the ``fd`` until it is closed."""
+    try:
+        while os.read(fd, 65536):
+            pass
+    except OSError:
+        pass
@@ -1,8 +1,29 @@
+import asyncio
+import io
+import mmap
+import os
+import pathlib
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch
 
 import iterfzf
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
 flavors = [
     "Chocolate", "Chocolate Chip", "Vanilla", "Strawberry", "Blueberry",
     "Rocky Road"
@@ -11,6 +32,20 @@ flavors = [
 
 class IterFzfTest(unittest.TestCase):
 
+    def patch_fzf(self):
+        """Replaces fzf with a mock process which takes the input and exits
+        without any choice.  Returns the patched ``subprocess.Popen`` and
+        the mock process.
+        """
+        patcher = patch("subprocess.Popen")
+        mock_open = patcher.start()
+        self.addCleanup(patcher.stop)
+        mock_process = mock_open.return_value
+        mock_process.wait.return_value = 1
+        mock_process.poll.return_value = None
+        mock_process.stdout.read.return_value = b""
+        return mock_open, mock_process
+
     def test_no_query(self):
         choice = iterfzf.iterfzf(flavors, executable="fzf")
         self.assertEqual("Chocolate", choice)
@@ -88,4 +123,901 @@ class IterFzfTest(unittest.TestCase):
             executable="fzf",
             tmux="top,60%",
         )
-        self.assertEqual("Vanilla", choice)
\ No newline at end of file
+        self.assertEqual("Vanilla", choice)
+
+    def test_batches_writes(self):
+        mock_open, mock_process = self.patch_fzf()
+        items = ["item {}".format(i) for i in range(1000)]
+
+        iterfzf.iterfzf(items, executable="fzf", batch_latency=60)
+        writes = [c.args[0] for c in mock_process.stdin.write.call_args_list]
+        # The first item is written alone, and the rest in a single batch:
+        self.assertEqual(2, len(writes))
+        self.assertEqual(b"item 0\n", writes[0])
+        self.assertEqual(
+            "".join(i + "\n" for i in items).encode(), b"".join(writes)
+        )
+
+        mock_process.stdin.reset_mock()
+        iterfzf.iterfzf(items, executable="fzf", batch_size=1)
+        self.assertEqual(len(items), mock_process.stdin.write.call_count)
+
+    def test_encode_batches(self):
+        batches = list(
+            iterfzf.encode_batches(
+                flavors[:3], encoding="utf-8", batch_size=16
+            )
+        )
+        self.assertEqual(
+            [
+                (flavors[:2], b"Chocolate\nChocolate Chip\n"),
+                (flavors[2:3], b"Vanilla\n"),
+            ],
+            batches,
+        )
+
+    def test_threaded(self):
+        mock_open, mock_process = self.patch_fzf()
+
+        def slow_flavors():
+            for flavor in flavors:
+                time.sleep(0.01)
+                yield flavor
+
+        iterfzf.iterfzf(slow_flavors(), executable="fzf", threaded=True)
+        writes = [c.args[0] for c in mock_process.stdin.write.call_args_list]
+        self.assertEqual(
+            "".join(f + "\n" for f in flavors).encode(), b"".join(writes)
+        )
+
+        def stalled_flavors():
+            yield from flavors[:3]
+            time.sleep(0.5)
+            yield flavors[3]
+
+        # Items held back are flushed while the iterable stalls:
+        mock_process.stdin.reset_mock()
+        iterfzf.iterfzf(
+            stalled_flavors(),
+            executable="fzf",
+            threaded=True,
+            batch_latency=0.05,
+        )
+        writes = [c.args[0] for c in mock_process.stdin.write.call_args_list]
+        self.assertEqual(
+            [
+                flavors[0].encode() + b"\n",
+                "".join(f + "\n" for f in flavors[1:3]).encode(),
+                flavors[3].encode() + b"\n",
+            ],
+            writes,
+        )
+
+        def failing_flavors():
+            yield flavors[0]
+            raise RuntimeError("failed")
+
+        with self.assertRaises(RuntimeError):
+            iterfzf.iterfzf(failing_flavors(), executable="fzf", threaded=True)
+
+    def test_aiterfzf(self):
+
+        async def aflavors():
+            for flavor in flavors:
+                await asyncio.sleep(0)
+                yield flavor
+
+        choice = asyncio.run(
+            iterfzf.aiterfzf(
+                aflavors(), query="Vani", __extra__=["-1"], executable="fzf"
+            )
+        )
+        self.assertEqual("Vanilla", choice)
+
+    def test_display(self):
+        records = [(i, flavor) for i, flavor in enumerate(flavors)]
+        choice = iterfzf.iterfzf(
+            records,
+            display=lambda r: r[1],
+            query="Vani",
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertEqual((2, "Vanilla"), choice)
+        query, choices = iterfzf.iterfzf(
+            records,
+            display=lambda r: r[1].encode(),
+            query="Vani",
+            multi=True,
+            print_query=True,
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertEqual(b"Vani", query)
+        self.assertEqual([(2, "Vanilla")], choices)
+        # Indices are kept in the filter mode, too:
+        choices = iterfzf.iterfzf(
+            records,
+            display=lambda r: r[1],
+            multi=True,
+            __extra__=["--filter=Choc"],
+            executable="fzf",
+        )
+        self.assertEqual(records[:2], choices)
+
+    def test_raw_input(self):
+        data = "".join(f + "\n" for f in flavors).encode()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "flavors.txt"
+            path.write_bytes(data)
+            sources = [data, bytearray(data), io.BytesIO(data), path]
+            for source in sources:
+                choice = iterfzf.iterfzf(
+                    source, query="Vani", __extra__=["-1"], executable="fzf"
+                )
+                self.assertEqual(b"Vanilla", choice)
+            with path.open("rb") as f:
+                self.assertEqual(b"Chocolate\n", f.readline())
+                choice = iterfzf.iterfzf(
+                    f, query="Choc", __extra__=["-1"], executable="fzf"
+                )
+                # The line already read is not passed to fzf:
+                self.assertEqual(b"Chocolate Chip", choice)
+                os.lseek(f.fileno(), 0, os.SEEK_SET)
+                choice = iterfzf.iterfzf(
+                    f.fileno(),
+                    query="Vani",
+                    __extra__=["-1"],
+                    executable="fzf",
+                )
+                self.assertEqual(b"Vanilla", choice)
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    choice = iterfzf.iterfzf(
+                        m, query="Vani", __extra__=["-1"], executable="fzf"
+                    )
+                self.assertEqual(b"Vanilla", choice)
+
+    def test_read0(self):
+        traces = [
+            "Traceback:\n  Chocolate\nValueError",
+            "Traceback:\n  Vanilla\nKeyError",
+        ]
+        choice = iterfzf.iterfzf(
+            traces,
+            read0=True,
+            query="Vani",
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertEqual(traces[1], choice)
+        self.assertRaises(
+            ValueError,
+            lambda: iterfzf.iterfzf(["a\0b"], read0=True, executable="fzf"),
+        )
+
+    def test_newline_policy(self):
+        mock_open, mock_process = self.patch_fzf()
+        items = ["a", "b\nc", "d\re", "f"]
+        expected = {
+            "replace": b"a\nb c\nd e\nf\n",
+            "skip": b"a\nf\n",
+            "escape": b"a\nb\\nc\nd\\re\nf\n",
+        }
+        for policy, data in expected.items():
+            for encode in (False, True):
+                mock_process.stdin.reset_mock()
+                iterfzf.iterfzf(
+                    [i.encode() for i in items] if encode else items,
+                    executable="fzf",
+                    newline_policy=policy,
+                    batch_latency=60,
+                )
+                writes = mock_process.stdin.write.call_args_list
+                self.assertEqual(data, b"".join(c.args[0] for c in writes))
+        self.assertRaises(
+            ValueError,
+            lambda: iterfzf.iterfzf(items, executable="fzf", batch_size=1),
+        )
+        self.assertRaises(
+            ValueError,
+            lambda: iterfzf.iterfzf(["a", b"b"], executable="fzf"),
+        )
+        with self.assertRaises(ValueError):
+            iterfzf.iterfzf(items, executable="fzf", newline_policy="ignore")
+
+    def test_filter(self):
+        matches = iterfzf.filter(flavors, "choc", executable="fzf")
+        self.assertEqual(["Chocolate", "Chocolate Chip"], sorted(matches))
+        matches = iterfzf.filter(
+            (f.encode() for f in flavors * 100),
+            "berry",
+            limit=3,
+            jobs=4,
+            batch_size=64,
+            executable="fzf",
+        )
+        matches = list(matches)
+        self.assertEqual(3, len(matches))
+        self.assertTrue(
+            all(m in (b"Strawberry", b"Blueberry") for m in matches)
+        )
+        self.assertEqual([], list(iterfzf.filter([], "x", executable="fzf")))
+
+    @unittest.skipIf(sys.platform == "win32", "headless mode requires a pty")
+    def test_session(self):
+        with iterfzf.FzfSession(headless=True, executable="fzf") as session:
+            session.load(flavors, prompt="flavor> ", query="Vani", timeout=10)
+            session.accept()
+            self.assertEqual("Vanilla", session.wait(timeout=10))
+            session.load([b"Rocky Road"], query="", timeout=10)
+            session.accept()
+            self.assertEqual(b"Rocky Road", session.wait(timeout=10))
+            session.load(flavors, timeout=10)
+            session.cancel()
+            self.assertIsNone(session.wait(timeout=10))
+
+    def test_lazy(self):
+        choices = iterfzf.iterfzf(
+            flavors,
+            query="Vani",
+            multi=True,
+            lazy=True,
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertFalse(isinstance(choices, list))
+        self.assertEqual(["Vanilla"], list(choices))
+        query, choices = iterfzf.iterfzf(
+            flavors,
+            query="Vani",
+            print_query=True,
+            lazy=True,
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertEqual("Vani", query)
+        self.assertEqual(["Vanilla"], list(choices))
+        self.assertEqual([], list(iterfzf.iterfzf([], lazy=True)))
+
+    def test_large_output(self):
+        items = ["item {}".format(i) for i in range(100000)]
+        choices = iterfzf.iterfzf(
+            items,
+            sort=True,
+            multi=True,
+            __extra__=["--filter="],
+            executable="fzf",
+        )
+        self.assertEqual(sorted(items), sorted(choices))
+
+    def test_on_stats(self):
+        stats = []
+        choice = iterfzf.iterfzf(
+            flavors,
+            query="Vani",
+            __extra__=["-1"],
+            executable="fzf",
+            on_stats=stats.append,
+        )
+        self.assertEqual("Vanilla", choice)
+        self.assertEqual(1, len(stats))
+        self.assertIsInstance(stats[0], iterfzf.FzfStats)
+        self.assertEqual(len(flavors), stats[0].items_fed)
+        self.assertEqual(sum(len(f) + 1 for f in flavors), stats[0].bytes_fed)
+        self.assertEqual(0, stats[0].exit_code)
+        self.assertFalse(stats[0].broken_pipe)
+        self.assertGreaterEqual(stats[0].total_seconds, stats[0].spawn_seconds)
+        # Raw inputs are counted as well, except for lines of files:
+        data = "".join(f + "\n" for f in flavors).encode()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "flavors.txt"
+            path.write_bytes(data)
+            for iterable, items in [
+                (iterfzf.CandidateSet(flavors), len(flavors)),
+                (data, 0),
+                (path, 0),
+            ]:
+                del stats[:]
+                iterfzf.iterfzf(
+                    iterable,
+                    query="Vani",
+                    __extra__=["-1"],
+                    executable="fzf",
+                    on_stats=stats.append,
+                )
+                self.assertEqual(items, stats[0].items_fed)
+                self.assertEqual(len(data), stats[0].bytes_fed)
+                self.assertGreater(stats[0].spawn_seconds, 0)
+
+    def test_candidate_set(self):
+        candidates = iterfzf.CandidateSet(flavors)
+        self.assertEqual(len(flavors), len(candidates))
+        self.assertEqual(flavors, list(candidates))
+        self.assertEqual("Vanilla", candidates[2])
+        self.assertEqual("Rocky Road", candidates[-1])
+        self.assertEqual(flavors[1:3], candidates[1:3])
+        for _ in range(2):
+            choice = iterfzf.iterfzf(
+                candidates, query="Vani", __extra__=["-1"], executable="fzf"
+            )
+            self.assertEqual("Vanilla", choice)
+        candidates = iterfzf.CandidateSet(
+            [f.encode() for f in flavors], read0=True
+        )
+        choice = iterfzf.iterfzf(
+            candidates, query="Vani", __extra__=["-1"], executable="fzf"
+        )
+        self.assertEqual(b"Vanilla", choice)
+        # fzf is not spawned for no candidates:
+        empty = iterfzf.CandidateSet([])
+        with patch("subprocess.Popen") as mock_open:
+            self.assertIsNone(iterfzf.iterfzf(empty, executable="fzf"))
+            self.assertEqual(
+                (None, None),
+                iterfzf.iterfzf(empty, print_query=True, executable="fzf"),
+            )
+        mock_open.assert_not_called()
+
+    def test_candidate_cache(self):
+        cache = iterfzf.CandidateCache(max_bytes=1000)
+        a = cache.get("a", lambda: flavors)
+        self.assertIs(a, cache.get("a", lambda: flavors))
+        self.assertIsNot(a, cache.get("a", lambda: flavors, version=2))
+        b = cache.get("b", lambda: ["x" * 450])
+        self.assertIn("a", cache)
+        self.assertIn("b", cache)
+        cache.get("c", lambda: ["y" * 450])
+        self.assertNotIn("a", cache)  # The least recently used one
+        self.assertLessEqual(cache.nbytes, 1000)
+        self.assertIs(b, cache.get("b", lambda: []))
+        cache.invalidate("b")
+        self.assertNotIn("b", cache)
+        cache.get("d", lambda: ["z" * 2048])
+        self.assertNotIn("d", cache)  # Too large by itself
+
+    def test_fan_in(self):
+
+        def slow(items):
+            for item in items:
+                time.sleep(0.01)
+                yield item
+
+        async def aslow(items):
+            for item in items:
+                await asyncio.sleep(0.01)
+                yield item
+
+        choice = iterfzf.iterfzf(
+            iterfzf.fan_in(
+                [slow(flavors[:3]), aslow(flavors[3:])],
+                tag=True,
+            ),
+            display=lambda t: t[1],
+            query="Straw",
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertEqual((1, "Strawberry"), choice)
+
+        def failing():
+            yield "Mint"
+            raise RuntimeError("failed")
+
+        errors = []
+        items = iterfzf.fan_in(
+            [failing(), slow(flavors)],
+            on_error=lambda i, e: errors.append((i, type(e))),
+        )
+        self.assertEqual(sorted(flavors + ["Mint"]), sorted(items))
+        self.assertEqual([(0, RuntimeError)], errors)
+        self.assertRaises(
+            RuntimeError, lambda: list(iterfzf.fan_in([failing(), flavors]))
+        )
+        # A single worker consumes the sources one by one:
+        self.assertEqual(
+            flavors,
+            list(iterfzf.fan_in([flavors[:3], flavors[3:]], max_workers=1)),
+        )
+        # A blocked source does not keep the interpreter from exiting:
+        code = (
+            "import threading, iterfzf\n"
+            "def blocked():\n"
+            "    threading.Event().wait()\n"
+            "    yield 'never'\n"
+            "print(next(iterfzf.fan_in([blocked(), ['Vanilla']])))\n"
+        )
+        output = subprocess.check_output(
+            [sys.executable, "-c", code], timeout=30
+        )
+        self.assertEqual(b"Vanilla", output.strip())
+
+    @unittest.skipIf(sys.platform == "win32", "previews are run by sh")
+    def test_preview_callable(self):
+        rendered = []
+
+        def render(item):
+            rendered.append(item)
+            return "preview of " + item
+
+        server = iterfzf.PreviewServer(
+            render, lambda line: line.decode(), encoding="utf-8"
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "focused"
+            path.write_bytes(b"Vanilla\n")
+            for which in [shutil.which, lambda name: None]:  # curl or python
+                server.start()
+                with patch("shutil.which", which):
+                    command = server.command("{f}", from_file=True)
+                try:
+                    output = subprocess.check_output(
+                        command.replace("{f}", shlex.quote(str(path))),
+                        shell=True,
+                    )
+                finally:
+                    server.close()
+                self.assertEqual(b"preview of Vanilla", output)
+        self.assertEqual(["Vanilla"], rendered)  # The second one is cached
+        # A request superseded while waiting for its turn is dropped:
+        results = []
+        with server._render_lock:
+            generation = server.generation
+            thread = threading.Thread(
+                target=lambda: results.append(server.serve(b"Chocolate\n"))
+            )
+            thread.start()
+            while server.generation == generation:
+                time.sleep(0.01)
+            server.generation += 1  # A newer request has come
+        thread.join()
+        self.assertEqual([None], results)
+        self.assertEqual(b"preview of Chocolate", server.serve(b"Chocolate"))
+
+    def test_preview_callable_command(self):
+        mock_open, mock_process = self.patch_fzf()
+        iterfzf.iterfzf(flavors, preview=str.upper, executable="fzf")
+        cmd = mock_open.call_args.args[0]
+        previews = [arg for arg in cmd if arg.startswith("--preview=")]
+        self.assertEqual(1, len(previews))
+        self.assertIn("{f}", previews[0])
+
+    @unittest.skipIf(sys.platform == "win32", "reloads are run by sh")
+    def test_source(self):
+        calls = []
+        closed = []
+
+        def source(query):
+            calls.append(query)
+            try:
+                for flavor in flavors:
+                    if query.lower() in flavor.lower():
+                        yield flavor
+            finally:
+                closed.append(query)
+
+        server = iterfzf.SourceServer(source, encoding="utf-8")
+        server.debounce = 0
+        server.start()
+        try:
+            for which in [shutil.which, lambda name: None]:  # curl or python
+                with patch("shutil.which", which):
+                    command = server.command(shlex.quote("choc"))
+                output = subprocess.check_output(command, shell=True)
+                self.assertEqual(b"Chocolate\nChocolate Chip\n", output)
+        finally:
+            server.close()
+        self.assertEqual(["choc"], calls)  # The second one is cached
+        self.assertEqual(["choc"], closed)
+        # A generation is cancelled once the query changes:
+        chunks = []
+
+        def write(chunk):
+            chunks.append(chunk)
+            server.generation += 1
+
+        server.batch_size = 1
+        server.handle(b"", write)
+        self.assertEqual([b"Chocolate\n"], chunks)
+        self.assertEqual(["choc", ""], closed)
+        self.assertNotIn("", server._cache)
+
+    def test_source_command(self):
+        mock_open, mock_process = self.patch_fzf()
+        queries = []
+
+        def source(query):
+            queries.append(query)
+            return flavors
+
+        iterfzf.iterfzf(
+            None,
+            source=source,
+            query="Choc",
+            bind={"change": "first"},
+            executable="fzf",
+        )
+        self.assertEqual(["Choc"], queries)
+        cmd = mock_open.call_args.args[0]
+        binds = [arg for arg in cmd if arg.startswith("--bind=")]
+        self.assertEqual(1, len(binds))
+        self.assertTrue(binds[0].startswith("--bind=change:reload("))
+        self.assertTrue(binds[0].endswith(")+first"))
+        self.assertIn("{q}", binds[0])
+        # fzf is started even if there is nothing for the initial query:
+        mock_open.reset_mock()
+        mock_process.stdin.reset_mock()
+        iterfzf.iterfzf(
+            None,
+            source=lambda query: [f for f in flavors if query and query in f],
+            executable="fzf",
+        )
+        self.assertTrue(mock_open.called)
+        mock_process.stdin.write.assert_not_called()
+        mock_process.stdin.close.assert_called_once_with()
+
+    @patch("iterfzf.SourceServer")
+    def test_source_dedupe(self, mock_server):
+        self.patch_fzf()
+        mock_server.return_value.command.return_value = "true"
+        for dedupe in [True, {"cherry"}, iterfzf.BloomFilter(capacity=100)]:
+            iterfzf.iterfzf(
+                None,
+                source=lambda query: ["apple", "apricot", "apple"],
+                dedupe=dedupe,
+                executable="fzf",
+            )
+            wrap = mock_server.call_args.args[1]
+            # Every reload is deduplicated on its own:
+            for _ in range(2):
+                self.assertEqual(
+                    ["apple", "apricot"],
+                    list(wrap(["apple", "apricot", "apple"], [])),
+                )
+
+    def test_source_table(self):
+
+        def source(query):
+            return [f for f in flavors if query in f]
+
+        server = iterfzf.SourceServer(
+            source,
+            lambda items, table: iterfzf.iter_with_index(items, str, table),
+            encoding="utf-8",
+        )
+        server.debounce = 0
+        self.assertIsNone(server.table)
+        chunks = []
+        server.handle(b"Choc", chunks.append)
+        chocolates = server.table
+        self.assertEqual(["Chocolate", "Chocolate Chip"], chocolates)
+        # Every generation is indexed from zero on its own table:
+        server.handle(b"Straw", chunks.append)
+        self.assertEqual(["Strawberry"], server.table)
+        self.assertTrue(chunks[-1].startswith(b"0\t"))
+        table = iterfzf.GenerationTable(["initial"], server)
+        self.assertEqual("Strawberry", table[0])
+        # A cached query brings its table back:
+        server.handle(b"Choc", chunks.append)
+        self.assertIs(chocolates, server.table)
+        self.assertEqual("Chocolate Chip", table[1])
+
+    @patch.object(iterfzf.CallbackServer, "close")
+    @patch.object(iterfzf.CallbackServer, "command", return_value="true")
+    @patch.object(iterfzf.CallbackServer, "start")
+    def test_servers_on_error(self, mock_start, mock_command, mock_close):
+        # Servers are not started for invalid options:
+        self.assertRaises(
+            TypeError,
+            lambda: iterfzf.iterfzf(
+                io.BytesIO(b"Vanilla\n"),
+                display=str,
+                preview=str,
+                executable="fzf",
+            ),
+        )
+        mock_start.assert_not_called()
+        # Servers are closed if fzf cannot be run:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertRaises(
+                FileNotFoundError,
+                lambda: iterfzf.iterfzf(
+                    flavors,
+                    preview=str,
+                    source=lambda query: flavors,
+                    executable=os.path.join(tmpdir, "fzf"),
+                ),
+            )
+        self.assertEqual(2, mock_start.call_count)
+        self.assertEqual(2, mock_close.call_count)
+        self.assertRaises(TypeError, iterfzf.CallbackServer)
+
+    def test_early_exit(self):
+        mock_open, mock_process = self.patch_fzf()
+        pulled = []
+        closed = []
+
+        def generate(delay=0):
+            try:
+                for i in range(1000):
+                    time.sleep(delay)
+                    pulled.append(i)
+                    yield str(i)
+            finally:
+                closed.append(len(pulled))
+
+        # fzf has exited as soon as the first item is written (e.g., -1):
+        mock_process.poll.return_value = 0
+        iterfzf.iterfzf(generate(), executable="fzf")
+        self.assertEqual([0], pulled)
+        self.assertEqual([1], closed)
+
+        mock_process.poll.return_value = None
+        del pulled[:], closed[:]
+        mock_process.stdin.reset_mock()
+        iterfzf.iterfzf(generate(), max_items=10, executable="fzf")
+        writes = [c.args[0] for c in mock_process.stdin.write.call_args_list]
+        self.assertEqual(
+            "".join("{}\n".format(i) for i in range(10)).encode(),
+            b"".join(writes),
+        )
+        self.assertEqual([10], closed)
+
+        del pulled[:], closed[:]
+        iterfzf.iterfzf(generate(0.01), timeout=0.1, executable="fzf")
+        self.assertLess(len(pulled), 1000)
+        self.assertEqual([len(pulled)], closed)
+
+        # Iterables other than generators belong to the caller, e.g., cursors:
+        class Cursor:
+            closed = False
+
+            def __iter__(self):
+                return iter(flavors)
+
+            def close(self):
+                self.closed = True
+
+        cursor = Cursor()
+        iterfzf.iterfzf(cursor, max_items=1, executable="fzf")
+        self.assertFalse(cursor.closed)
+
+        self.assertRaises(
+            ValueError,
+            lambda: iterfzf.iterfzf(flavors, max_items=0, executable="fzf"),
+        )
+
+    def test_dedupe(self):
+        mock_open, mock_process = self.patch_fzf()
+        items = flavors + ["vanilla", "Chocolate"] + flavors
+
+        def fed(**options):
+            mock_process.stdin.reset_mock()
+            iterfzf.iterfzf(items, executable="fzf", **options)
+            writes = mock_process.stdin.write.call_args_list
+            lines = b"".join(c.args[0] for c in writes).decode().split("\n")
+            return lines[:-1]
+
+        self.assertEqual(flavors + ["vanilla"], fed(dedupe=True))
+        self.assertEqual(flavors, fed(dedupe=True, key=str.lower))
+        self.assertEqual(
+            flavors + ["vanilla"],
+            fed(dedupe=iterfzf.BloomFilter(capacity=100)),
+        )
+        self.assertEqual(
+            ["Chocolate Chip", "Strawberry"],
+            fed(dedupe=True, score=len, top_k=2),
+        )
+        self.assertRaises(ValueError, lambda: fed(top_k=2))
+
+    def test_bloom_filter(self):
+        bloom = iterfzf.BloomFilter(capacity=10000, error_rate=0.01)
+        for i in range(10000):
+            bloom.add(i)
+        self.assertTrue(all(i in bloom for i in range(10000)))
+        false_positives = sum(i in bloom for i in range(10000, 20000))
+        self.assertLess(false_positives, 200)
+
+    def test_tail_table(self):
+        table = iterfzf.TailTable(3)
+        lines = list(iterfzf.iter_with_index(range(10), str, table))
+        self.assertEqual("9\t9", lines[-1])
+        self.assertEqual(10, len(table))
+        self.assertEqual([7, 8, 9], list(table.elements))
+        self.assertEqual(8, table[8])
+        self.assertRaises(IndexError, lambda: table[6])
+        records = list(enumerate(flavors))
+        choice = iterfzf.iterfzf(
+            records,
+            display=lambda r: r[1],
+            tail=3,
+            query="Rocky",
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertEqual((5, "Rocky Road"), choice)
+
+    def test_tail_and_rate_limit(self):
+        mock_open, mock_process = self.patch_fzf()
+        items = ["item {:02}".format(i) for i in range(50)]
+
+        def writes():
+            calls = mock_process.stdin.write.call_args_list
+            mock_process.stdin.reset_mock()
+            return [c.args[0] for c in calls]
+
+        iterfzf.iterfzf(items, tail=3, batch_latency=60, executable="fzf")
+        self.assertIn("--tail=3", mock_open.call_args.args[0])
+        # Items older than the tail are not even written:
+        self.assertEqual(
+            [b"item 00\n", b"item 47\nitem 48\nitem 49\n"], writes()
+        )
+
+        for options in [{"rate_limit": 100}, {"byte_rate_limit": 800}]:
+            started = time.monotonic()
+            iterfzf.iterfzf(items, batch_size=40, executable="fzf", **options)
+            self.assertGreaterEqual(time.monotonic() - started, 0.4)
+            chunks = writes()
+            self.assertEqual(
+                "".join(i + "\n" for i in items).encode(), b"".join(chunks)
+            )
+            self.assertLessEqual(len(chunks), 11)
+        self.assertRaises(
+            ValueError,
+            lambda: iterfzf.iterfzf(items, rate_limit=0, executable="fzf"),
+        )
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_array(self):
+        for column in [numpy.array(flavors), numpy.array(flavors, "S")]:
+            choice = iterfzf.iterfzf(
+                column, query="Vani", __extra__=["-1"], executable="fzf"
+            )
+            self.assertEqual(2, choice)
+            for sort in [False, True]:
+                choices = iterfzf.iterfzf(
+                    column,
+                    query="Choc",
+                    multi=True,
+                    sort=sort,
+                    __extra__=["--filter=Choc"],
+                    executable="fzf",
+                )
+                self.assertEqual([0, 1], choices)
+        column = numpy.array(["Rocky\nRoad", "Vanilla"])
+        self.assertRaises(
+            ValueError, lambda: iterfzf.iterfzf(column, executable="fzf")
+        )
+        choice = iterfzf.iterfzf(
+            column,
+            query="Rocky Road",
+            newline_policy="replace",
+            __extra__=["-1"],
+            executable="fzf",
+        )
+        self.assertEqual(0, choice)
+        self.assertIsNone(
+            iterfzf.iterfzf(numpy.array([], str), executable="fzf")
+        )
+        with self.assertRaises(TypeError):
+            iterfzf.iterfzf(
+                numpy.array(flavors), display=str, executable="fzf"
+            )
+
+    @unittest.skipIf(
+        numpy is None or pyarrow is None, "pyarrow is not installed"
+    )
+    def test_arrow_array(self):
+        columns = [
+            pyarrow.array(flavors),
+            pyarrow.array(["Mint"] + flavors).slice(1),
+            pyarrow.chunked_array([flavors[:3], flavors[3:]]),
+            pyarrow.array([f.encode() for f in flavors], pyarrow.binary()),
+        ]
+        for column in columns:
+            choice = iterfzf.iterfzf(
+                column, query="Vani", __extra__=["-1"], executable="fzf"
+            )
+            self.assertEqual(2, choice)
+
+    def test_table_command(self):
+        mock_open, mock_process = self.patch_fzf()
+        rows = [
+            {
+                "host": "web-1",
+                "region": "us-east",
+                "owner": "alice"
+            },
+            {
+                "host": "database-1",
+                "region": "eu",
+                "owner": "bob"
+            },
+        ]
+        iterfzf.iterfzf_table(
+            rows, ["host", "owner"], match=["owner"], executable="fzf"
+        )
+        cmd = mock_open.call_args.args[0]
+        self.assertIn("--header=host        owner", cmd)
+        self.assertIn("--nth=2", cmd)
+        self.assertIn("--with-nth=2..", cmd)
+        writes = mock_process.stdin.write.call_args_list
+        self.assertEqual(
+            b"0\tweb-1      \talice\n1\tdatabase-1 \tbob\n",
+            b"".join(c.args[0] for c in writes),
+        )
+        with self.assertRaises(ValueError):
+            iterfzf.iterfzf_table(
+                rows, ["host"], match=["owner"], executable="fzf"
+            )
+
+    def test_table(self):
+        rows = [(flavor, len(flavor)) for flavor in flavors]
+        choice = iterfzf.iterfzf_table(
+            iter(rows), query="Vani", __extra__=["-1"], executable="fzf"
+        )
+        self.assertIs(rows[2], choice)
+        self.assertIsNone(iterfzf.iterfzf_table([], executable="fzf"))
+
+    @patch("iterfzf.fzf_version", return_value=(0, 62, 0))
+    def test_eager_start(self, mock_version):
+        mock_open, mock_process = self.patch_fzf()
+
+        def slow_flavors():
+            # fzf is already spawned before the first item is computed:
+            self.assertTrue(mock_open.called)
+            yield from flavors
+
+        iterfzf.iterfzf(
+            slow_flavors(),
+            eager_start=True,
+            header="Flavors",
+            executable="fzf"
+        )
+        cmd = mock_open.call_args.args[0]
+        self.assertIn("--header=Loading...", cmd)
+        self.assertIn("--bind=result:change-header(Flavors)", cmd)
+        mock_process.terminate.assert_not_called()
+        mock_open.reset_mock()
+        mock_process.reset_mock()
+        mock_process.poll.return_value = None
+        choice = iterfzf.iterfzf(iter([]), eager_start=True, executable="fzf")
+        # fzf which got no input is closed, and nothing is chosen as usual:
+        self.assertIsNone(choice)
+        self.assertTrue(mock_open.called)
+        mock_process.terminate.assert_called_once_with()
+        mock_process.stdout.read.assert_not_called()
+
+    def test_find_executable(self):
+        self.assertEqual("/opt/fzf", iterfzf.find_executable("/opt/fzf"))
+        executable = iterfzf.find_executable()
+        self.assertTrue(os.access(executable, os.X_OK))
+        self.assertIs(executable, iterfzf.find_executable())
+        self.assertIsInstance(iterfzf.BUNDLED_EXECUTABLE, pathlib.Path)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fake = pathlib.Path(tmpdir) / "fzf"
+            fake.write_text("#!/bin/sh\necho '0.44.1 (debian)'\n")
+            fake.chmod(0o755)
+            self.assertEqual((0, 44, 1), iterfzf.fzf_version(fake))
+        # The version is cached even after the executable is gone:
+        self.assertEqual((0, 44, 1), iterfzf.fzf_version(fake))
+        iterfzf.fzf_version.cache_clear()
+        self.assertIsNone(iterfzf.fzf_version(fake))
+
+    def test_lazy_imports(self):
+        code = (
+            "import sys, iterfzf; "
+            "print(' '.join(m for m in ('pathlib', 'subprocess', 'queue', "
+            "'shlex') if m in sys.modules))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE,
+            check=True,
+            env=dict(
+                os.environ,
+                PYTHONPATH=os.path.dirname(
+                    os.path.dirname(os.path.abspath(iterfzf.__file__))
+                )
+            ),
+        ).stdout
+        self.assertEqual(b"", output.strip())
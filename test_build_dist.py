@@ -0,0 +1,195 @@
+import hashlib
+import http.server
+import io
+import json
+import pathlib
+import tarfile
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+import zipfile
+
+try:
+    import build_dist
+except ImportError:  # flit_core is not installed
+    build_dist = None
+
+
+def make_tarball(name, data):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def make_zip(name, data):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as z:
+        z.writestr(name, data)
+    return buffer.getvalue()
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """A local stand-in for GitHub, which serves the ``files`` (a map from
+    paths to contents) and records the requested paths.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = []
+        self.not_modified = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                server.requests.append(path)
+                if path not in server.files:
+                    self.send_error(404)
+                    return
+                data = server.files[path]
+                etag = '"{0}"'.format(hashlib.sha256(data).hexdigest())
+                if self.headers.get("If-None-Match") == etag:
+                    server.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{0}".format(self.server_address[1])
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+@unittest.skipIf(build_dist is None, "flit_core is not installed")
+class BuildDistTest(unittest.TestCase):
+
+    def setUp(self):
+        version = build_dist.__fzf_version__
+        archives = {
+            "fzf-{0}-linux_amd64.tar.gz".format(version):
+                make_tarball("fzf", b"linux binary"),
+            "fzf-{0}-windows_amd64.zip".format(version):
+                make_zip("fzf.exe", b"windows binary"),
+        }
+        checksums = "".join(
+            "{0}  {1}\n".format(hashlib.sha256(data).hexdigest(), name)
+            for name, data in archives.items()
+        )
+        files = {"/" + name: data for name, data in archives.items()}
+        files["/" + build_dist.fzf_checksums_filename] = checksums.encode()
+        self.server = StandInServer(files)
+        release = {
+            "assets":
+                [
+                    {
+                        "name": path[1:],
+                        "browser_download_url": self.server.url + path,
+                    } for path in files
+                ]
+        }
+        files["/release"] = json.dumps(release).encode()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        tmp = pathlib.Path(self.tmpdir.name)
+        self.patcher = patch.multiple(
+            build_dist,
+            release_url=self.server.url + "/release",
+            fzf_release_path=tmp / "release.json",
+            fzf_release_etag_path=tmp / "etag" / "release.json.etag",
+            offline_mirror=None,
+            fzf_bin_path=tmp / "fzf",
+            fzf_windows_bin_path=tmp / "fzf.exe",
+            cache_dir=tmp / "cache",
+            _checksums={},
+        )
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    def test_fetch_fzf_binaries(self):
+        platforms = [("linux", "amd64"), ("windows", "amd64")]
+        paths = build_dist.fetch_fzf_binaries(platforms)
+        self.assertEqual(b"linux binary", paths["linux", "amd64"].read_bytes())
+        self.assertEqual(
+            b"windows binary", paths["windows", "amd64"].read_bytes()
+        )
+        self.assertEqual("fzf.exe", paths["windows", "amd64"].name)
+        version = build_dist.__fzf_version__
+        name = "/fzf-{0}-linux_amd64.tar.gz".format(version)
+        archive = self.server.files[name]
+        digest = hashlib.sha256(archive).hexdigest()
+        self.assertEqual(
+            build_dist.cache_dir / version / "linux_amd64" / digest / "fzf",
+            paths["linux", "amd64"],
+        )
+        # The release JSON and checksums are fetched only once:
+        self.assertEqual(1, self.server.requests.count("/release"))
+        checksums = "/" + build_dist.fzf_checksums_filename
+        self.assertEqual(1, self.server.requests.count(checksums))
+        del self.server.requests[:]
+        self.assertEqual(paths, build_dist.fetch_fzf_binaries(platforms))
+        self.assertEqual([], self.server.requests)  # Served from the cache
+
+        build_dist.download_fzf_binary("linux", "amd64")
+        self.assertEqual(b"linux binary", build_dist.fzf_bin_path.read_bytes())
+        self.assertTrue(build_dist.fzf_bin_path.stat().st_mode & 0o111)
+
+    def test_checksum_mismatch(self):
+        archive = "fzf-{0}-linux_amd64.tar.gz".format(
+            build_dist.__fzf_version__
+        )
+        build_dist._checksums[archive] = "0" * 64
+        self.assertRaises(
+            RuntimeError, build_dist.fetch_fzf_binary, "linux", "amd64"
+        )
+        self.assertEqual(
+            [],
+            [p for p in build_dist.cache_dir.rglob("*") if p.is_file()],
+        )
+
+    def test_release_json_revalidation(self):
+        release = build_dist.download_fzf_release_json()
+        self.assertTrue(build_dist.fzf_release_etag_path.is_file())
+        self.assertEqual(0, self.server.not_modified)
+        self.assertEqual(release, build_dist.download_fzf_release_json())
+        self.assertEqual(1, self.server.not_modified)
+        self.assertEqual(2, self.server.requests.count("/release"))
+
+    def test_offline_mirror(self):
+        mirror = pathlib.Path(self.tmpdir.name) / "mirror"
+        build_dist.mirror_fzf_release(mirror)
+        build_dist.fzf_release_path.unlink()
+        build_dist._checksums.clear()
+        del self.server.requests[:]
+        platforms = [("linux", "amd64"), ("windows", "amd64")]
+        with patch.object(build_dist, "offline_mirror", mirror):
+            paths = build_dist.fetch_fzf_binaries(platforms)
+        self.assertEqual([], self.server.requests)
+        self.assertEqual(
+            b"windows binary", paths["windows", "amd64"].read_bytes()
+        )
+        build_dist.fzf_release_path.unlink()
+        empty = pathlib.Path(self.tmpdir.name) / "empty"
+        empty.mkdir()
+        with patch.object(build_dist, "offline_mirror", empty):
+            self.assertRaises(RuntimeError, build_dist.get_fzf_release)
+        self.assertEqual([], self.server.requests)
+
+
+if __name__ == "__main__":
+    unittest.main()